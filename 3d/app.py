@@ -1,9 +1,55 @@
-from flask import Flask, jsonify, request, render_template, send_from_directory
-from pathfinder import calculate_distances, tsp_nearest_neighbor, tsp_brute_force
+import base64
+import json
+
+from flask import Flask, Response, abort, jsonify, redirect, request, render_template, send_from_directory, url_for
+from pathfinder import (StoreGraph, SOLVERS, DEFAULT_BUDGET_MS, MAX_BUDGET_MS, RouteCache, SolverLimitError,
+                        UNREACHABLE, check_solver_limits, reoptimize_route, solve_route, solve_routes, solver_pool)
 from db import GroceryDBInterface
+from distance_cache import DistanceCache, pickup_ids
+from hierarchy import HIERARCHY_MIN_BFS_CELLS, HierarchicalGraph
+from assets import ModelAssets
+from jobs import FINISHED, JobQueue, QueueFull
+from locks import ReadWriteLock
+import metrics
+from map_transport import FAST, EncodedMap
+from pickups import access_ids, candidate_ids, choose_access_tiles, consolidate, route_ids
+from picking import CapacityError, plan_routes
 
 app = Flask(__name__)
 
+# most stops added or removed since the previous route that are still repaired instead of solved again
+INCREMENTAL_MAX_DELTA = 5
+
+# content addressed responses never change under their url
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class RequestError(ValueError):
+    """Raised for an invalid request body, answered with 400 and the message"""
+
+
+@app.errorhandler(RequestError)
+@app.errorhandler(SolverLimitError)
+def bad_request(error):
+    return jsonify({"error": str(error)}), 400
+
+
+def encoded_response(encoded, mimetype, cache_control):
+    """Respond with the smallest precompressed variant the client accepts, or 304 if its copy is current"""
+    encoding, body, etag = encoded.pick(request.accept_encodings)
+
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        response.set_data(b'')
+        return response
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
 
 @app.route('/')
 def index():
@@ -12,7 +58,49 @@ def index():
 
 @app.route('/map-data')
 def map_data():
-    return jsonify(map_data_dict)
+    """Serve the precompressed map of the current layout, or 304 if the client has it already.
+
+    ``?format=tiles`` returns the original list of tile objects instead of the columnar encoding.
+    """
+    encoded = map_payloads['tiles' if request.args.get('format') == 'tiles' else 'columnar']
+    # always revalidate, the ETag changes with the layout
+    return encoded_response(encoded, 'application/json', 'no-cache')
+
+
+@app.route('/model/manifest')
+def model_manifest():
+    """List the content addressed urls of all models and the bundle of the models in the current layout"""
+    return jsonify(model_assets.manifest(layout_types))
+
+
+@app.route('/model/bundle')
+def model_bundle_for_types():
+    """Redirect to the immutable bundle of the models in the current layout.
+
+    A comma separated ``types`` is accepted only if it names the models of the layout, any other
+    combination would build and cache a bundle per request.
+    """
+    types = request.args.get('types')
+    if types and set(types.split(',')) & model_assets.models.keys() != layout_types & model_assets.models.keys():
+        raise RequestError("Only the bundle of the models in the current layout is served")
+    digest = model_assets.bundle(layout_types)
+    return redirect(url_for('model_bundle', digest=digest))
+
+
+@app.route('/model/bundle/<digest>')
+def model_bundle(digest):
+    bundle = model_assets.bundles.get(digest)
+    if bundle is None:
+        abort(404)
+    return encoded_response(bundle, 'application/octet-stream', IMMUTABLE)
+
+
+@app.route('/model/<digest>/<model_type>.fbx')
+def hashed_model(digest, model_type):
+    asset = model_assets.models.get(model_type)
+    if asset is None or asset.digest != digest:
+        abort(404)
+    return encoded_response(asset, 'application/octet-stream', IMMUTABLE)
 
 
 @app.route('/model/<path:filename>')
@@ -26,21 +114,355 @@ def serve_image():
     return send_from_directory('static', 'colormap.png', mimetype='image/png')
 
 
+@app.route('/layout/tiles', methods=['POST'])
+def edit_layout():
+    """Change tiles of the live layout, e.g. block an aisle while restocking or move a shelf.
+
+    Takes ``{"tiles": [{"id": ..., "type": ..., "rotation": ..., "shelf_id": ...}]}``, where
+    every field besides the id is optional. Only distances the edit may lengthen are searched again.
+    """
+    global shelf_tiles
+    edits = request.json['tiles']
+    tile_dict = {tile['id']: tile for tile in map_data_dict['tiles']}
+    unknown = [edit['id'] for edit in edits if edit['id'] not in tile_dict]
+    if unknown:
+        return jsonify({"error": f"Unknown tiles {unknown}"}), 400
+
+    with layout_lock.writing():
+        for edit in edits:
+            tile_dict[edit['id']].update(edit)
+        types = {edit['id']: tile_dict[edit['id']].get('type') for edit in edits if 'type' in edit}
+        shelf_tiles = {tile['shelf_id']: tile['id'] for tile in map_data_dict['tiles'] if tile.get('shelf_id') is not None}
+        if store_hierarchy is not None:
+            changes = store_graph.set_tile_types(types)
+            clusters = {store_hierarchy.cluster_of(store_graph.cell_of[tile_id]) for tile_id in types}
+            store_hierarchy.update(clusters)
+            recomputed = {"recomputed_clusters": len(clusters)}
+        else:
+            changes, sources = distance_cache.apply_edits(store_graph, types)
+            distance_cache.load_layout(store_graph, distance_sources())
+            recomputed = {"recomputed_sources": len(sources)}
+        publish_layout()
+        layout = store_graph.layout_key()
+
+    return jsonify({
+        "layout": layout,
+        "changed_edges": len(changes),
+        **recomputed,
+    })
+
+
+def publish_layout():
+    """Serialize the current layout for /map-data and collect the models it uses.
+
+    Called while edits hold layout_lock, so compression is left to the first request per encoding.
+    """
+    global map_payloads, layout_types
+    map_payloads = {
+        'columnar': EncodedMap(map_data_dict['tiles']),
+        # the legacy format is many times larger and rarely requested
+        'tiles': EncodedMap(map_data_dict['tiles'], columnar=False, levels=FAST),
+    }
+    layout_types = {tile['type'] for tile in map_data_dict['tiles'] if tile.get('type') is not None}
+
+
 @app.route('/pathfind', methods=['POST'])
 def pathfind():
+    """Solve the route for a shopping list; with ``?profile=1`` the response includes a stage breakdown"""
+    if request.args.get('profile') == '1':
+        with metrics.profiling() as profile:
+            response = solve_pathfind()
+        if isinstance(response, dict):
+            response['profile'] = profile
+        return response
+    return solve_pathfind()
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Stage timings and counters of the routing pipeline in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def solve_pathfind():
     data = request.json
     items = data['items']  # list of items
 
-    #for item in items:
-    #    print(item)
-    #    result = db_interface.search_groceries(item)
-    #    print(result)
+    solver, budget_ms = solver_options(data)
+
+    with layout_lock.reading():
+        with metrics.stage('resolve_items'):
+            stops = stops_for_items(items)
+            ids = route_ids(entrance_id, register_id, stops)
+            check_solver_limits(solver, len(ids) - 2, budget_ms)
+        with metrics.stage('distances'):
+            distances = route_distances(candidate_ids(entrance_id, register_id, stops))
+        layout = store_graph.layout_key()
+        # with the token of the previous route, a small edit of the list only repairs that route
+        previous = parse_route_token(data.get('previous')) if solver == 'auto' else None
+    if previous is not None:
+        added = set(ids[1:-1]) - set(previous)
+        removed = set(previous[1:-1]) - set(ids[1:-1])
+        if len(added) + len(removed) <= INCREMENTAL_MAX_DELTA:
+            with metrics.stage('reoptimize'):
+                route = reoptimize_route(previous, distances, added=added, removed=removed)
+        else:
+            previous = None
+    if previous is None:
+        with metrics.stage('solve'):
+            route = route_cache.solve(layout, entrance_id, register_id, ids, distances,
+                                      budget_ms=budget_ms, solver=solver)
+
+    with metrics.stage('response'), layout_lock.reading():
+        return route_response(route, distances, stops)
+
+
+@app.route('/pathfind/cache', methods=['GET'])
+def pathfind_cache():
+    """Size and hit/miss counters of the route cache"""
+    return jsonify(route_cache.stats())
+
+
+@app.route('/pathfind/batch', methods=['POST'])
+def pathfind_batch():
+    """Solve many shopping lists on the current layout, streaming one JSON line per list in input order"""
+    data = request.json
+    solver, budget_ms = solver_options(data)
 
-    path_dict = [{'x': tile_dict[p]['x'], 'y': tile_dict[p]['y']} for p in path]
-    optimal_path_dict = [{'x': tile_dict[p]['x'], 'y': tile_dict[p]['y']} for p in optimal_path]
+    with layout_lock.reading():
+        list_stops = [stops_for_items(items) for items in data['lists']]
+        routes = [
+            (entrance_id, register_id, route_ids(entrance_id, register_id, stops))
+            for stops in list_stops
+        ]
+        for _, _, ids in routes:
+            check_solver_limits(solver, len(ids) - 2, budget_ms)
+        all_ids = list(dict.fromkeys(
+            tile_id for stops in list_stops for tile_id in candidate_ids(entrance_id, register_id, stops)
+        ))
+        distances = route_distances(all_ids)
+
+    def generate():
+        solved = solve_routes(routes, distances, budget_ms=budget_ms, solver=solver, executor=batch_executor)
+        for route, stops in zip(solved, list_stops):
+            with layout_lock.reading():
+                response = route_response(route, distances, stops)
+            yield json.dumps(response) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/pathfind/pickers', methods=['POST'])
+def pathfind_pickers():
+    """Split one large shopping list across several pickers, returning one route per picker.
+
+    Takes the body of /pathfind plus ``pickers`` and an optional ``capacity``
+    in items per cart. The longest route is minimized, routes are returned
+    longest first.
+    """
+    data = request.json
+    solver, budget_ms = solver_options(data)
+    pickers = data.get('pickers', 1)
+    capacity = data.get('capacity')
+    if not all(isinstance(value, int) and value >= 1 for value in (pickers, capacity) if value is not None):
+        return jsonify({"error": "pickers and capacity must be positive integers"}), 400
+
+    with layout_lock.reading():
+        stops = stops_for_items(data['items'])
+        distances = route_distances(candidate_ids(entrance_id, register_id, stops))
+    try:
+        routes = plan_routes(entrance_id, register_id, route_ids(entrance_id, register_id, stops)[1:-1], distances,
+                             pickers, capacity=capacity,
+                             loads={stop.tile: len(stop.items) for stop in stops if stop.options},
+                             budget_ms=budget_ms, solver=solver, executor=batch_executor)
+    except CapacityError as error:
+        return jsonify({"error": str(error)}), 400
+    if not routes and stops:
+        # everything is picked at the entrance or register
+        routes = [solve_route(entrance_id, register_id, [entrance_id, register_id], distances)]
+
+    # items picked at the entrance or register go with the first route only
+    route_stops = [stop for stop in stops if stop.options]
+    with layout_lock.reading():
+        responses = [route_response(route, distances, stops if i == 0 else route_stops)
+                     for i, route in enumerate(routes)]
+    # choosing access tiles can change the lengths, so sort again
+    responses.sort(key=lambda response: -response['distance'])
+    return jsonify({
+        "routes": responses,
+        "makespan": max((response['distance'] for response in responses), default=0),
+        "total_distance": sum(response['distance'] for response in responses),
+    })
+
+
+@app.route('/pathfind/jobs', methods=['POST'])
+def submit_pathfind_job():
+    """Queue a route solve and return its job id right away.
+
+    Takes the same body as /pathfind. Responds 503 while the queue is full.
+    """
+    data = request.json
+    solver, budget_ms = solver_options(data)
+    with layout_lock.reading():
+        stops = stops_for_items(data['items'])
+    ids = route_ids(entrance_id, register_id, stops)
+    check_solver_limits(solver, len(ids) - 2, budget_ms)
+
+    def run(job):
+        with layout_lock.reading():
+            distances = route_distances(candidate_ids(entrance_id, register_id, stops))
+            layout = store_graph.layout_key()
+        best_distance = None
+
+        def on_improve(path, distance):
+            nonlocal best_distance
+            if best_distance is None or distance < best_distance:
+                best_distance = distance
+                job.publish({"pickup": [store_graph.coordinates(p) for p in path], "distance": distance})
+
+        route = route_cache.solve(layout, entrance_id, register_id, ids, distances,
+                                  budget_ms=budget_ms, solver=solver, cancelled=job.cancelled, on_improve=on_improve)
+        with layout_lock.reading():
+            return route_response(route, distances, stops)
+
+    try:
+        job = solve_jobs.submit(run)
+    except QueueFull as error:
+        return jsonify({"error": str(error)}), 503, {'Retry-After': '1'}
+    return jsonify({"id": job.id, "status": job.status}), 202, {'Location': url_for('pathfind_job', job_id=job.id)}
+
+
+@app.route('/pathfind/jobs/<job_id>', methods=['GET'])
+def pathfind_job(job_id):
+    job = solve_jobs.get(job_id) or abort(404)
+    return jsonify(job.as_dict())
+
+
+@app.route('/pathfind/jobs/<job_id>', methods=['DELETE'])
+def cancel_pathfind_job(job_id):
+    """Cancel a job; a running solve stops with the best route found so far"""
+    job = solve_jobs.get(job_id) or abort(404)
+    job.cancel()
+    return jsonify(job.as_dict())
+
+
+@app.route('/pathfind/jobs/<job_id>/events', methods=['GET'])
+def pathfind_job_events(job_id):
+    """Stream the job state as server-sent events until it finishes"""
+    job = solve_jobs.get(job_id) or abort(404)
+
+    def generate():
+        version = -1
+        while True:
+            changed = job.wait(version, timeout=15)
+            if changed == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = changed
+            state = job.as_dict()
+            yield f"event: {state['status']}\ndata: {json.dumps(state)}\n\n"
+            if state['status'] in FINISHED:
+                return
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+def solver_options(data):
+    """Read the ``solver`` and ``budget_ms`` of a request body, raising RequestError if they are invalid"""
+    solver = data.get('solver', 'auto')
+    if solver != 'auto' and solver not in SOLVERS:
+        raise RequestError(f"Unknown solver '{solver}'")
+    budget_ms = data.get('budget_ms', DEFAULT_BUDGET_MS)
+    if isinstance(budget_ms, bool) or not isinstance(budget_ms, (int, float)) or not 0 < budget_ms <= MAX_BUDGET_MS:
+        raise RequestError(f"budget_ms must be a number of milliseconds above 0 and at most {MAX_BUDGET_MS}")
+    return solver, budget_ms
+
+
+def stops_for_items(items):
+    """Resolve shopping list items to pickup stops, merging shelves that are picked from the same tile.
+
+    Reads the layout, like route_distances and route_response, so callers hold layout_lock for reading.
+    """
+    return consolidate(store_graph, db_interface.resolve_items(items), shelf_tiles, entrance_id, register_id)
+
+
+def route_token(path):
+    """Opaque token of a route on the current layout, sent back to /pathfind to edit it incrementally"""
+    data = json.dumps({"layout": store_graph.layout_key(), "path": path}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def parse_route_token(token):
+    """Return the route path of a token, or None if it is missing, malformed or from another layout"""
+    if not token:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token))
+        path = [int(tile_id) for tile_id in data['path']]
+    except (ValueError, TypeError, KeyError):
+        return None
+    if data.get('layout') != store_graph.layout_key() or path[:1] != [entrance_id] or path[-1:] != [register_id]:
+        return None
+    if not all(tile_id in store_graph.cell_of for tile_id in path):
+        return None
+    return path
+
+
+def route_response(route, distances, stops):
+    """Turn a solved route into the tile coordinates and stats returned to the frontend.
+
+    The route is solved over the representative tile of each stop, the access
+    tiles are chosen here. Every entry of ``stops`` holds the path walked to
+    one stop, where to stand and the shelves and items to pick there; the last
+    one leads to the register. Items picked at the entrance or register belong
+    to the first or last entry. The solver's lower bound is dropped if moving
+    the stops shortened the route below it. On approximate distances the route
+    was solved on estimates, so its length is taken from the refined legs and
+    no bound or gap is reported.
+    """
+    by_tile = {stop.tile: stop for stop in stops if stop.options}
+    at_tile = {stop.tile: stop for stop in stops if not stop.options}
+    optimal_path, distance = choose_access_tiles(route['path'], stops, distances)
+    lower_bound, gap = route['lower_bound'], route['gap']
+    if distance != route['distance']:
+        lower_bound = lower_bound if lower_bound is not None and lower_bound <= distance else None
+        gap = (distance - lower_bound) / lower_bound if lower_bound else None
 
-    # TODO return list of subpaths, items per subpickup, pickupspot for subpickups
-    return jsonify(path=path_dict, pickup=optimal_path_dict)
+    path = []
+    legs = []
+    walked = 0
+    for i in range(len(optimal_path)-1):
+        leg = distances.path(optimal_path[i], optimal_path[i+1])
+        walked += len(leg) - 1 if leg else UNREACHABLE
+        path.extend(leg[1 if i > 0 else 0:])
+        picked = [by_tile.get(route['path'][i+1])]
+        if i == 0:
+            picked.append(at_tile.get(optimal_path[0]))
+        if i == len(optimal_path) - 2:
+            picked.append(at_tile.get(optimal_path[-1]))
+        picked = [stop for stop in picked if stop is not None]
+        legs.append({
+            "path": [store_graph.coordinates(p) for p in leg],
+            "pickup": store_graph.coordinates(optimal_path[i+1]),
+            "shelves": [store_graph.coordinates(p) for stop in picked for p in stop.shelves],
+            "items": [item for stop in picked for item in stop.items],
+        })
+    if distances.approximate:
+        distance, lower_bound, gap = walked, None, None
+
+    return {
+        "path": [store_graph.coordinates(p) for p in path],
+        "pickup": [store_graph.coordinates(p) for p in optimal_path],
+        "stops": legs,
+        "distance": distance,
+        "solver": route['solver'],
+        "elapsed_ms": route['elapsed_ms'],
+        "lower_bound": lower_bound,
+        "gap": gap,
+        "approximate": distances.approximate,
+        "cache": route.get('cache'),
+        "token": route_token(route['path']),
+    }
 
 
 db_interface = GroceryDBInterface()
@@ -49,31 +471,71 @@ db_interface = GroceryDBInterface()
 @app.route('/groceries', methods=['GET'])
 def all_groceries():
     groceries = db_interface.get_all_groceries()
-    return jsonify(groceries)
+    return jsonify([grocery.as_dict() for grocery in groceries])
 
 
 @app.route('/groceries/category/<category_name>', methods=['GET'])
 def groceries_by_category(category_name):
     groceries = db_interface.get_groceries_by_category(category_name)
-    return jsonify(groceries)
+    return jsonify([grocery.as_dict() for grocery in groceries])
 
 
 @app.route('/grocery/<int:grocery_id>', methods=['GET'])
 def grocery_by_id(grocery_id):
     grocery = db_interface.get_grocery_by_id(grocery_id)
-    return jsonify(grocery) if grocery else jsonify({"error": "Grocery not found"}), 404
+    return jsonify(grocery.as_dict()) if grocery else jsonify({"error": "Grocery not found"}), 404
 
 
 @app.route('/groceries/shelf/<int:shelf_id>', methods=['GET'])
 def groceries_by_shelf(shelf_id):
     groceries = db_interface.get_groceries_by_shelf(shelf_id)
-    return jsonify(groceries)
+    return jsonify([grocery.as_dict() for grocery in groceries])
 
 
 @app.route('/search/<search_term>', methods=['GET'])
 def search_groceries(search_term):
     results = db_interface.search_groceries(search_term)
-    return jsonify(results)
+    return jsonify([grocery.as_dict() for grocery in results])
+
+
+def load_store(tiles, entrance, register, db_path='grocery_store.db', parent_layout=None):
+    """Serve a store layout: build its graph and prepare the distances between pickup tiles.
+
+    Layouts where a BFS per distance source would visit too many cells are routed on a hierarchical
+    graph instead of caching the distances between the sources. If the layout was derived from another
+    one, passing that layout key as ``parent_layout`` updates its cached distances instead.
+    """
+    global map_data_dict, entrance_id, register_id, shelf_tiles, store_graph, distance_cache, store_hierarchy
+    global layout_lock
+    map_data_dict = {"tiles": tiles}
+    entrance_id, register_id = entrance, register
+    shelf_tiles = {tile['shelf_id']: tile['id'] for tile in tiles if tile.get('shelf_id') is not None}
+
+    store_graph = StoreGraph(tiles)
+    publish_layout()
+    layout_lock = ReadWriteLock()  # edits write; requests read the graph, cached distances and hierarchy
+    distance_cache = DistanceCache(db_path)
+    sources = distance_sources()
+    if len(store_graph) * len(set(sources)) >= HIERARCHY_MIN_BFS_CELLS:
+        store_hierarchy = HierarchicalGraph(store_graph)
+    else:
+        store_hierarchy = None
+        distance_cache.load_layout(store_graph, sources, parent=parent_layout)
+
+
+def distance_sources():
+    """Tiles whose distances are precomputed: route endpoints, shelves and the tiles shelves are picked from"""
+    return pickup_ids(map_data_dict['tiles']) + access_ids(store_graph, shelf_tiles.values())
+
+
+def route_distances(ids):
+    """Distance matrix between tiles of the current layout, called while holding layout_lock for reading.
+
+    Solving only needs the matrix, so the lock can be released until the response is built.
+    """
+    if store_hierarchy is not None:
+        return store_hierarchy.distances(ids)
+    return distance_cache.distances(ids, store_graph)
 
 
 if __name__ == '__main__':
@@ -115,12 +577,11 @@ if __name__ == '__main__':
         shelf["type"] = i['type']
         ids_to_visit.append(x+y*width)
 
-    distances = calculate_distances(ids_to_visit, tile_dict)
-    # tsp_path = tsp_nearest_neighbor(ids_to_visit[0], ids_to_visit[-1], ids_to_visit, distances)
-    optimal_path, _ = tsp_brute_force(ids_to_visit[0], ids_to_visit[-1], ids_to_visit, distances)
-
-    path = []
-    for i in range(len(optimal_path)-1):
-        path.extend(distances[(optimal_path[i], optimal_path[i+1])][1][1 if i > 0 else 0:])
+    db_interface.ensure_schema()
+    load_store(map_data_dict['tiles'], ids_to_visit[0], ids_to_visit[-1])
+    model_assets = ModelAssets('static/fbx')
+    batch_executor = solver_pool()
+    solve_jobs = JobQueue()
+    route_cache = RouteCache()
 
     app.run(debug=True)
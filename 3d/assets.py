@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from map_transport import compress_variants, pick_variant
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+class Asset:
+    """A file served under a content hash, with its precompressed variants"""
+
+    def __init__(self, body):
+        self.body = body
+        self.digest = content_hash(body)
+        self.variants = compress_variants(body)
+
+    def pick(self, accept_encodings):
+        return pick_variant(self.body, self.digest, self.variants, accept_encodings)
+
+
+class ModelAssets:
+    """Manifest of the FBX models, read, hashed and compressed once at startup.
+
+    Models are addressed by content hash, so their responses never change and
+    can be cached forever. A bundle packs several models into one response:
+    a little-endian uint32 header length, a JSON header mapping each model
+    type to its [offset, length] in the payload, followed by the payload.
+    Only the ``max_bundles`` most recently requested bundles are kept.
+    """
+
+    def __init__(self, directory, max_bundles=8):
+        self.models = {}
+        for filename in sorted(os.listdir(directory)):
+            model_type, extension = os.path.splitext(filename)
+            if extension == '.fbx':
+                with open(os.path.join(directory, filename), 'rb') as file:
+                    self.models[model_type] = Asset(file.read())
+        self.bundles = OrderedDict()  # bundle digest -> Asset, least recently used first
+        self.max_bundles = max_bundles
+        self.lock = threading.Lock()
+
+    def url(self, model_type):
+        return f"/model/{self.models[model_type].digest}/{model_type}.fbx"
+
+    def bundle(self, model_types):
+        """Return the bundle of all known models among `model_types`, building it on first use"""
+        model_types = sorted(set(model_types) & self.models.keys())
+        digest = content_hash(' '.join(
+            f"{model_type}:{self.models[model_type].digest}" for model_type in model_types).encode('utf-8'))
+        with self.lock:
+            if digest in self.bundles:
+                self.bundles.move_to_end(digest)
+                return digest
+
+        header, payload = {}, []
+        offset = 0
+        for model_type in model_types:
+            body = self.models[model_type].body
+            header[model_type] = [offset, len(body)]
+            payload.append(body)
+            offset += len(body)
+        header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        asset = Asset(struct.pack('<I', len(header)) + header + b''.join(payload))
+        with self.lock:
+            self.bundles[digest] = asset
+            while len(self.bundles) > self.max_bundles:
+                self.bundles.popitem(last=False)
+        return digest
+
+    def manifest(self, layout_types=()):
+        """Describe every model and the bundle of the models a layout uses"""
+        return {
+            "models": {
+                model_type: {"url": self.url(model_type), "hash": asset.digest, "size": len(asset.body)}
+                for model_type, asset in self.models.items()
+            },
+            "bundle": f"/model/bundle/{self.bundle(layout_types)}",
+        }
@@ -0,0 +1 @@
+"""Performance benchmarks for the store routing backend. Run the modules with ``python -m benchmarks.<name>``."""
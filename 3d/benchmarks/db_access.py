@@ -0,0 +1,107 @@
+"""Throughput of GroceryDBInterface before and after connection pooling.
+
+The "before" variant opens a new connection for every query and builds one
+dict per row, like the original implementation. Run from the ``3d`` folder:
+
+    python -m benchmarks.db_access --rows 20000 --threads 8
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db import GroceryDBInterface, create_schema
+
+
+class UnpooledGroceryDB(GroceryDBInterface):
+    """Reference implementation: one connection per query and dict rows"""
+
+    def _query(self, query, params=(), row_factory=None):
+        cursor = sqlite3.connect(self.db_path).cursor()
+        cursor.row_factory = dict_row
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+    def search_groceries(self, search_term):
+        rows = self._query('''
+            SELECT groceries.id, groceries.name, groceries.shelf_id, categories.name AS category_name
+            FROM groceries
+            JOIN categories ON groceries.category_id = categories.id
+            WHERE groceries.name LIKE ? OR categories.name LIKE ?
+        ''', (f'%{search_term}%',) * 2)
+        shelves = {}
+        for row in rows:
+            shelves[row["shelf_id"]] = shelves.get(row["shelf_id"], 0) + 1
+        if not shelves:
+            return []
+        shelf_id = max(shelves, key=shelves.get)
+        return [row for row in rows if row["shelf_id"] == shelf_id]
+
+
+def dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def build_catalog(path, rows, seed=0):
+    """Create a synthetic catalog with the given number of groceries"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    create_schema(cursor)
+    categories = [f"Kategorie {i}" for i in range(max(rows // 100, 1))]
+    cursor.executemany('INSERT INTO categories (name) VALUES (?)', [(name,) for name in categories])
+    cursor.executemany(
+        'INSERT INTO groceries (shelf_id, name, category_id) VALUES (?, ?, ?)',
+        [(rng.randint(1, 200), f"Artikel {i}", rng.randint(1, len(categories))) for i in range(rows)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def throughput(operation, args, threads, seconds):
+    """Calls per second of operation(*args) over a number of threads"""
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        calls = 0
+        while time.perf_counter() < deadline:
+            operation(*args[calls % len(args)])
+            calls += 1
+        return calls
+
+    with ThreadPoolExecutor(threads) as executor:
+        calls = sum(executor.map(lambda _: worker(), range(threads)))
+    return calls / seconds
+
+
+# method name -> argument tuples cycled through by the workers
+OPERATIONS = {
+    'get_all_groceries': [()],
+    'search_groceries': [("Artikel 12",), ("Kategorie 3",), ("xyz",)],
+    'get_groceries_by_shelf': [(i,) for i in range(1, 201)],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'catalog.db')
+        build_catalog(path, args.rows)
+
+        print(f"{'operation':<24}{'before/s':>12}{'after/s':>12}{'speedup':>10}")
+        for name, calls in OPERATIONS.items():
+            before = throughput(getattr(UnpooledGroceryDB(path), name), calls, args.threads, args.seconds)
+            after = throughput(getattr(GroceryDBInterface(path), name), calls, args.threads, args.seconds)
+            print(f"{name:<24}{before:>12.1f}{after:>12.1f}{after / before:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Seeded generators for synthetic stores, catalogs and shopping lists.
+
+The same seed always yields the same store, catalog and lists, so benchmark
+results of different commits are comparable.
+"""
+import random
+
+SHELF_TYPES = ["shelf-boxes", "shelf-bags", "freezer", "freezer-standing", "display-bread", "display-fruit",
+               "bottle-return"]
+
+
+class SyntheticStore:
+    """A generated store layout in the tile format of /map-data.
+
+    Shelves stand in back to back rows separated by aisles, with cross aisles
+    at regular intervals and a main aisle along the walls. The entrance is a
+    door in the bottom wall and the register stands next to it. Every shelf
+    tile has its own shelf id.
+    """
+
+    def __init__(self, width, height, seed=0, aisle_width=2, run_length=12):
+        rng = random.Random(seed)
+        self.width, self.height = width, height
+        self.tiles = []
+        tile_at = {}
+        for y in range(height):
+            for x in range(width):
+                border = x in (0, width - 1) or y in (0, height - 1)
+                corner = x in (0, width - 1) and y in (0, height - 1)
+                tile = {
+                    "id": x + y * width, "x": x, "y": y, "shelf_id": None,
+                    "type": "wall-corner" if corner else "wall" if border else None,
+                    "rotation": 90 if x == 0 and not corner else None,
+                }
+                self.tiles.append(tile)
+                tile_at[x, y] = tile
+
+        # shelf area inside a main aisle of two tiles along the walls, the register row at the bottom
+        left, right, top, bottom = 3, width - 4, 3, height - 6
+        self.runs = []  # tile ids of each shelf run, in order
+        y = top
+        while y + 1 <= bottom:
+            for row in (y, y + 1):  # back to back rows
+                x = left
+                while x <= right:
+                    run = [tile_at[column, row] for column in range(x, min(x + run_length, right + 1))]
+                    shelf_type = rng.choice(SHELF_TYPES)
+                    for tile in run:
+                        tile['type'] = shelf_type
+                        tile['rotation'] = 0 if row == y else 180
+                    self.runs.append([tile['id'] for tile in run])
+                    x += run_length + 1  # one tile cross aisle
+            y += 2 + aisle_width
+
+        shelf_id = 0
+        for run in self.runs:
+            for tile_id in run:
+                shelf_id += 1
+                self.tiles[tile_id]['shelf_id'] = shelf_id
+        self.shelves = {tile['shelf_id']: tile['id'] for tile in self.tiles if tile['shelf_id'] is not None}
+
+        door_x = min(2, width - 2)
+        door = tile_at[door_x, height - 1]
+        door['type'] = 'wall-door-rotate'
+        self.entrance = door['id']
+        register = tile_at[min(door_x + 2, width - 2), max(height - 3, 1)]
+        register['type'] = 'cash-register'
+        register['shelf_id'] = None
+        self.register = register['id']
+
+
+def catalog(store, rows, seed=0):
+    """Generate ``(id, name, category, shelf_id)`` rows, one category per shelf run, as importer rows"""
+    rng = random.Random(seed)
+    runs = [run for run in store.runs if run]
+    categories = [f"Kategorie {i}" for i in range(len(runs))]
+    products = []
+    for grocery_id in range(1, rows + 1):
+        run = rng.randrange(len(runs))
+        shelf_id = store.tiles[rng.choice(runs[run])]['shelf_id']
+        products.append((grocery_id, f"Artikel {grocery_id}", categories[run], shelf_id))
+    return products
+
+
+def shopping_lists(products, count, seed=0, mean_size=12, max_size=60, popularity=0.8):
+    """Generate shopping lists of product names.
+
+    List sizes follow a lognormal distribution around ``mean_size`` and products
+    are drawn with Zipf-like popularity, so some products appear in many lists.
+    """
+    rng = random.Random(seed)
+    names = [product[1] for product in products]
+    weights = [1 / (rank + 1) ** popularity for rank in range(len(names))]
+    lists = []
+    for _ in range(count):
+        size = min(max(1, round(rng.lognormvariate(0, 0.5) * mean_size)), max_size, len(names))
+        items = set()
+        while len(items) < size:
+            items.update(rng.choices(names, weights, k=size - len(items)))
+        lists.append(sorted(items))
+    return lists
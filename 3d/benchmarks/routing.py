@@ -0,0 +1,206 @@
+"""Reproducible benchmarks of path search, distance matrices, TSP solvers and the Flask endpoints.
+
+Stores, catalogs and shopping lists are generated from a seed, so runs on
+different commits measure the same work. Results are written as JSON to
+compare them across commits. Run from the ``3d`` folder:
+
+    python -m benchmarks.routing --sizes 10,100,500 --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathfinder import (SOLVERS, StoreGraph, a_star, calculate_distances, jump_point_search, solve_route,
+                        tsp_held_karp)
+from benchmarks.generators import SyntheticStore, catalog, shopping_lists
+from hierarchy import HierarchicalGraph
+
+# number of intermediate stops of the benchmarked routes
+LIST_SIZES = [5, 8, 12, 16, 25, 50]
+
+# largest number of stops each exact solver is run for
+SOLVER_MAX_STOPS = {'brute_force': 8, 'held_karp': 16, 'branch_and_bound': 16}
+
+# largest number of stops for which the optimum is computed to measure route quality
+OPTIMUM_MAX_STOPS = 12
+
+
+def timed(operation, repeat):
+    """Run operation() `repeat` times, returning timing statistics in milliseconds and the last result"""
+    times = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        result = operation()
+        times.append((time.perf_counter() - began) * 1000)
+    times.sort()
+    return {
+        'runs': repeat,
+        'mean_ms': statistics.fmean(times),
+        'min_ms': times[0],
+        'p50_ms': times[len(times) // 2],
+        'p95_ms': times[min(len(times) - 1, int(len(times) * 0.95))],
+    }, result
+
+
+def bench_search(store, graph, rng, pairs):
+    """Time a_star and jump point search between random pairs of shelves"""
+    shelves = list(store.shelves.values())
+    routes = [tuple(rng.sample(shelves, 2)) for _ in range(pairs)]
+    results = []
+    for name, search in (('a_star', a_star), ('jump_point_search', jump_point_search)):
+        stats, _ = timed(lambda: [search(a, b, graph) for a, b in routes], 1)
+        results.append({'benchmark': name, 'pairs': pairs, 'per_pair_ms': stats['mean_ms'] / pairs, **stats})
+    return results
+
+
+def bench_solvers(store, graph, rng, repeat):
+    """Time every solver per list size and compare its distance to the optimum where that is computable"""
+    shelves = list(store.shelves.values())
+    results = []
+    for k in LIST_SIZES:
+        if k > len(shelves):
+            break
+        ids = [store.entrance] + rng.sample(shelves, k) + [store.register]
+        stats, distances = timed(lambda: calculate_distances(ids, graph), 1)
+        results.append({'benchmark': 'calculate_distances', 'stops': k + 2, **stats})
+
+        optimum = None
+        if k <= OPTIMUM_MAX_STOPS:
+            _, optimum = tsp_held_karp(store.entrance, store.register, ids, distances)
+
+        for name, solver in SOLVERS.items():
+            if k > SOLVER_MAX_STOPS.get(name, k):
+                continue
+            stats, (_, distance) = timed(lambda: solver(store.entrance, store.register, ids, distances), repeat)
+            results.append(quality({'benchmark': f'solver.{name}', 'stops': k, **stats}, distance, optimum))
+
+        stats, route = timed(lambda: solve_route(store.entrance, store.register, ids, distances), repeat)
+        results.append(quality({'benchmark': 'solve_route', 'stops': k, 'solver': route['solver'], **stats},
+                               route['distance'], optimum))
+    return results
+
+
+def bench_hierarchy(store, graph, rng, repeat, stops=25):
+    """Time building the hierarchical graph and its distance matrices, and their error against exact BFS distances"""
+    stats, hierarchy = timed(lambda: HierarchicalGraph(graph), 1)
+    results = [{'benchmark': 'HierarchicalGraph', 'clusters': len(hierarchy.intra), 'nodes': len(hierarchy.nodes), **stats}]
+    shelves = list(store.shelves.values())
+    ids = [store.entrance] + rng.sample(shelves, min(stops, len(shelves))) + [store.register]
+    stats, approximate = timed(lambda: hierarchy.distances(ids), repeat)
+    exact_stats, exact = timed(lambda: calculate_distances(ids, graph), 1)
+    errors = [approximate[a, b] / exact[a, b] - 1 for a in ids for b in ids if a != b and exact[a, b]]
+    results.append({'benchmark': 'hierarchy.distances', 'stops': len(ids), 'exact_ms': exact_stats['mean_ms'],
+                    'mean_error': statistics.fmean(errors), 'max_error': max(errors), **stats})
+    return results
+
+
+def quality(result, distance, optimum):
+    result['distance'] = distance
+    if optimum is not None:
+        result['optimum'] = optimum
+        result['gap'] = (distance - optimum) / optimum if optimum else 0.0
+    return result
+
+
+def bench_endpoints(store, products, lists, repeat):
+    """Time the Flask endpoints on the generated store with a generated catalog"""
+    import app as server
+    from db import GroceryDBInterface
+    from importer import import_catalog
+    from pathfinder import RouteCache
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'store.db')
+        import_catalog(products, db_path=db_path, report=None)
+        server.db_interface = GroceryDBInterface(db_path)
+        stats, _ = timed(lambda: server.load_store(store.tiles, store.entrance, store.register, db_path=db_path), 1)
+        results.append({'benchmark': 'load_store', 'pickups': len(store.shelves) + 2, **stats})
+        server.batch_executor = None
+        client = server.app.test_client()
+
+        for name, cache_size in (('POST /pathfind', 0), ('POST /pathfind cached', 1024)):
+            server.route_cache = RouteCache(max_size=cache_size)
+            calls = iter(lists * repeat)
+            stats, _ = timed(lambda: client.post('/pathfind', json={'items': next(calls)}), len(lists) * repeat)
+            results.append({'benchmark': name, **stats})
+
+        terms = [product[1] for product in products[:repeat]]
+        calls = iter(terms)
+        stats, _ = timed(lambda: client.get(f'/search/{next(calls)}'), len(terms))
+        results.append({'benchmark': 'GET /search', **stats})
+
+        stats, _ = timed(lambda: client.get('/map-data', headers={'Accept-Encoding': 'gzip'}), repeat)
+        results.append({'benchmark': 'GET /map-data', **stats})
+        server.db_interface.close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,50,100,250,500', help="comma separated store edge lengths")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--pairs', type=int, default=50, help="point to point searches per store")
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--lists', type=int, default=20)
+    parser.add_argument('--endpoint-max-size', type=int, default=100,
+                        help="largest store the endpoints are benchmarked on")
+    parser.add_argument('--hierarchy-min-size', type=int, default=100,
+                        help="smallest store the hierarchical graph is benchmarked on")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    for size in map(int, args.sizes.split(',')):
+        rng = random.Random(args.seed)
+        store = SyntheticStore(size, size, seed=args.seed)
+        stats, graph = timed(lambda: StoreGraph(store.tiles), 1)
+        size_results = [{'benchmark': 'StoreGraph', **stats}]
+        size_results += bench_search(store, graph, rng, args.pairs)
+        size_results += bench_solvers(store, graph, rng, args.repeat)
+        if size >= args.hierarchy_min_size:
+            size_results += bench_hierarchy(store, graph, rng, args.repeat)
+        if size <= args.endpoint_max_size:
+            products = catalog(store, args.products, seed=args.seed)
+            lists = shopping_lists(products, args.lists, seed=args.seed)
+            size_results += bench_endpoints(store, products, lists, args.repeat)
+
+        for result in size_results:
+            result['store'] = f"{size}x{size}"
+            detail = ', '.join(f"{key}={result[key]}" for key in ('stops', 'solver') if key in result)
+            gap = f"  gap {result['gap']:.1%}" if 'gap' in result else ''
+            print(f"{result['store']:>9} {result['benchmark']:<28}{detail:<28}{result['mean_ms']:>10.2f} ms{gap}",
+                  file=sys.stderr)
+        results += size_results
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'arguments': vars(args),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
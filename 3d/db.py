@@ -1,14 +1,213 @@
+import queue
 import sqlite3
 import random
-from collections import Counter
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import metrics
+
+
+class Grocery:
+    """Lightweight grocery record, cheaper to build than one dict per row"""
+    __slots__ = ('id', 'name', 'shelf_id', 'category')
+
+    def __init__(self, id, name, shelf_id=None, category=None):
+        self.id = id
+        self.name = name
+        self.shelf_id = shelf_id
+        self.category = category
+
+    def __repr__(self):
+        return f"Grocery({self.id!r}, {self.name!r}, {self.shelf_id!r}, {self.category!r})"
+
+    def as_dict(self):
+        """Dict of the fields the query selected, for JSON responses"""
+        return {field: getattr(self, field) for field in self.__slots__ if getattr(self, field) is not None}
+
+
+def grocery_row(cursor, row):
+    """Row factory building Grocery records (id, name, shelf_id, category)"""
+    return Grocery(*row)
+
+
+def shelf_grocery_row(cursor, row):
+    """Row factory for queries selecting (id, name, category) of a known shelf"""
+    return Grocery(row[0], row[1], category=row[2])
+
+
+def create_schema(cursor):
+    """Create the categories and groceries tables if they do not exist yet"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS groceries (
+            id INTEGER PRIMARY KEY,
+            shelf_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            category_id INTEGER NOT NULL,
+            FOREIGN KEY (category_id) REFERENCES categories(id)
+        )
+    ''')
+
+    # Secondary indexes for the shelf and category lookups
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_groceries_shelf_id ON groceries (shelf_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_groceries_category_id ON groceries (category_id)')
+
+    create_search_index(cursor)
+    create_catalog_version(cursor)
+
+
+def create_catalog_version(cursor):
+    """Create a single row counter that triggers bump on every catalog change.
+
+    Readers compare it against the version their caches were filled at.
+    """
+    cursor.execute('CREATE TABLE IF NOT EXISTS catalog_version (version INTEGER NOT NULL)')
+    cursor.execute('INSERT INTO catalog_version (version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM catalog_version)')
+    for table in ('groceries', 'categories'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE catalog_version SET version = version + 1;
+                END
+            ''')
+
+
+def create_search_index(cursor):
+    """Create the trigram full-text index over grocery and category names.
+
+    The index is kept in sync with the groceries and categories tables by
+    triggers and filled from the existing rows when it is first created.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'grocery_search'")
+    exists = cursor.fetchone() is not None
+
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS grocery_search
+        USING fts5(name, category, tokenize = 'trigram')
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS groceries_search_insert AFTER INSERT ON groceries BEGIN
+            INSERT INTO grocery_search (rowid, name, category)
+            SELECT new.id, new.name, categories.name FROM categories WHERE categories.id = new.category_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS groceries_search_delete AFTER DELETE ON groceries BEGIN
+            DELETE FROM grocery_search WHERE rowid = old.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS groceries_search_update AFTER UPDATE OF name, category_id ON groceries BEGIN
+            DELETE FROM grocery_search WHERE rowid = old.id;
+            INSERT INTO grocery_search (rowid, name, category)
+            SELECT new.id, new.name, categories.name FROM categories WHERE categories.id = new.category_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS categories_search_update AFTER UPDATE OF name ON categories BEGIN
+            UPDATE grocery_search SET category = new.name
+            WHERE rowid IN (SELECT id FROM groceries WHERE category_id = new.id);
+        END
+    ''')
+
+    if not exists:
+        rebuild_search_index(cursor)
+
+
+def rebuild_search_index(cursor):
+    """Refill the full-text index from the groceries and categories tables"""
+    cursor.execute('DELETE FROM grocery_search')
+    cursor.execute('''
+        INSERT INTO grocery_search (rowid, name, category)
+        SELECT groceries.id, groceries.name, categories.name
+        FROM groceries
+        JOIN categories ON groceries.category_id = categories.id
+    ''')
 
 
 class GroceryDBInterface:
-    def __init__(self, db_path='grocery_store.db'):
+    """Read-only access to the grocery catalog.
+
+    Queries borrow a connection from a pool shared by all threads, since the
+    server starts a new thread per request. Connections are opened in WAL
+    mode with ``query_only``, memory-mapped I/O and a prepared statement
+    cache, and up to ``pool_size`` idle ones are kept open. They cannot create
+    anything, so call ensure_schema once at startup.
+    """
+
+    def __init__(self, db_path='grocery_store.db', mmap_size=256 * 1024 * 1024, cached_statements=128,
+                 resolve_cache_size=4096, pool_size=8):
         self.db_path = db_path
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue(maxsize=pool_size)  # the most recently used connection has the warmest cache
+
+        # LRU cache of resolved search terms -> shelf id, valid for one catalog version
+        self.resolve_cache_size = resolve_cache_size
+        self._resolve_cache = OrderedDict()
+        self._resolve_cache_version = None
+        self._resolve_lock = threading.Lock()
 
     def _connect(self):
-        return sqlite3.connect(self.db_path)
+        # a connection is used by one thread at a time, but not always the one that opened it
+        conn = sqlite3.connect(self.db_path, cached_statements=self.cached_statements, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        """Borrow an idle connection, or open one if all are in use"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def ensure_schema(self):
+        """Bring the database up to the current schema on a writable connection.
+
+        Databases created by an older version lack the search index and the
+        catalog version, which are created and filled here. Safe to call on an
+        up to date database.
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.execute('PRAGMA journal_mode = WAL')
+                create_schema(conn.cursor())
+        finally:
+            conn.close()
+
+    def close(self):
+        """Close the idle connections of the pool"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _query(self, query, params=(), row_factory=grocery_row):
+        """Run a query and return all its rows, the connection goes back to the pool"""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = row_factory
+            cursor.execute(query, params)
+            return cursor.fetchall()
 
     def get_all_groceries(self):
         """Retrieve all groceries with their category and shelf information"""
@@ -18,16 +217,7 @@ class GroceryDBInterface:
             JOIN categories ON groceries.category_id = categories.id
             ORDER BY groceries.shelf_id
         '''
-        with self._connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(query)
-            rows = cursor.fetchall()
-
-        groceries = [
-            {"id": row[0], "name": row[1], "shelf_id": row[2], "category": row[3]}
-            for row in rows
-        ]
-        return groceries
+        return self._query(query)
 
     def get_groceries_by_category(self, category_name):
         """Retrieve groceries by a specific category name"""
@@ -38,16 +228,7 @@ class GroceryDBInterface:
             WHERE categories.name = ?
             ORDER BY groceries.shelf_id
         '''
-        with self._connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, (category_name,))
-            rows = cursor.fetchall()
-
-        groceries = [
-            {"id": row[0], "name": row[1], "shelf_id": row[2]}
-            for row in rows
-        ]
-        return groceries
+        return self._query(query, (category_name,))
 
     def get_grocery_by_id(self, grocery_id):
         """Retrieve a single grocery item by its ID"""
@@ -57,14 +238,8 @@ class GroceryDBInterface:
             JOIN categories ON groceries.category_id = categories.id
             WHERE groceries.id = ?
         '''
-        with self._connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, (grocery_id,))
-            row = cursor.fetchone()
-
-        if row:
-            return {"id": row[0], "name": row[1], "shelf_id": row[2], "category": row[3]}
-        return None
+        rows = self._query(query, (grocery_id,))
+        return rows[0] if rows else None
 
     def get_groceries_by_shelf(self, shelf_id):
         """Retrieve all groceries on a specific shelf."""
@@ -74,54 +249,121 @@ class GroceryDBInterface:
             JOIN categories ON groceries.category_id = categories.id
             WHERE groceries.shelf_id = ?
         '''
-        with self._connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, (shelf_id,))
-            rows = cursor.fetchall()
-
-        groceries = [
-            {"id": row[0], "name": row[1], "category": row[2]}
-            for row in rows
-        ]
-        return groceries
+        return self._query(query, (shelf_id,), shelf_grocery_row)
 
     def search_groceries(self, search_term):
         """Search groceries by category name or grocery name with a case-insensitive substring match.
         Returns results where most items share the same shelf_id.
+
+        Terms of three or more characters are looked up in the trigram index,
+        shorter ones fall back to a LIKE scan. Results are ranked with prefix
+        matches first, and the most common shelf is picked in SQL.
         """
-        query = '''
+        search_pattern = f'%{search_term}%'
+        if len(search_term) >= 3:
+            matches = '''
+                SELECT rowid AS id, bm25(grocery_search) AS score
+                FROM grocery_search
+                WHERE grocery_search MATCH ?
+            '''
+            params = ['"' + search_term.replace('"', '""') + '"']
+        else:
+            matches = '''
+                SELECT rowid AS id, 0 AS score
+                FROM grocery_search
+                WHERE name LIKE ? OR category LIKE ?
+            '''
+            params = [search_pattern, search_pattern]
+
+        query = f'''
+            WITH matches AS ({matches}),
+            best_shelf AS (
+                SELECT groceries.shelf_id
+                FROM matches
+                JOIN groceries ON groceries.id = matches.id
+                GROUP BY groceries.shelf_id
+                ORDER BY COUNT(*) DESC, MIN(matches.score)
+                LIMIT 1
+            )
             SELECT groceries.id, groceries.name, groceries.shelf_id, categories.name AS category_name
-            FROM groceries
+            FROM matches
+            JOIN groceries ON groceries.id = matches.id
             JOIN categories ON groceries.category_id = categories.id
-            WHERE groceries.name LIKE ? OR categories.name LIKE ?
+            WHERE groceries.shelf_id = (SELECT shelf_id FROM best_shelf)
+            ORDER BY groceries.name LIKE ? DESC, categories.name LIKE ? DESC, matches.score
         '''
-        search_pattern = f'%{search_term}%'
+        prefix_pattern = f'{search_term}%'
+        return self._query(query, params + [prefix_pattern, prefix_pattern])
 
-        with self._connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, (search_pattern, search_pattern))
-            rows = cursor.fetchall()
-
-        # Structure the data and identify the most common shelf ID
-        groceries = [
-            {"id": row[0], "name": row[1], "shelf_id": row[2], "category": row[3]}
-            for row in rows
-        ]
-
-        # Count shelf IDs to find the most common one
-        shelf_counts = Counter(grocery["shelf_id"] for grocery in groceries)
-        if not shelf_counts:
-            return []  # No results found
+    def resolve_items(self, items):
+        """Resolve a whole shopping list to shelves in a single query.
 
-        # Get the shelf_id with the highest count
-        most_common_shelf_id = shelf_counts.most_common(1)[0][0]
-
-        # Filter groceries to only include items on the most common shelf
-        filtered_groceries = [
-            grocery for grocery in groceries if grocery["shelf_id"] == most_common_shelf_id
-        ]
-
-        return filtered_groceries
+        Every item is matched like in search_groceries and assigned to its most
+        common shelf. Returns a dict mapping shelf ids to the items picked
+        there, in list order. Items without a match are left out. Resolved
+        terms are kept in an LRU cache that is dropped when the catalog changes.
+        """
+        version = self._query('SELECT version FROM catalog_version', row_factory=None)[0][0]
+        # normalized like search_groceries, the index and LIKE compare case themselves
+        terms = {item: item.strip() for item in items}
+
+        with self._resolve_lock:
+            if version != self._resolve_cache_version:
+                self._resolve_cache.clear()
+                self._resolve_cache_version = version
+            resolved = {}
+            for term in set(terms.values()):
+                if term in self._resolve_cache:
+                    self._resolve_cache.move_to_end(term)
+                    resolved[term] = self._resolve_cache[term]
+        missing = [term for term in set(terms.values()) if term not in resolved]
+        metrics.count('resolve_cache_requests', len(resolved), result='hit')
+        metrics.count('resolve_cache_requests', len(missing), result='miss')
+
+        if missing:
+            found = dict.fromkeys(missing)
+            found.update(self._resolve_terms(missing))
+            resolved.update(found)
+            with self._resolve_lock:
+                if version == self._resolve_cache_version:
+                    self._resolve_cache.update(found)
+                    while len(self._resolve_cache) > self.resolve_cache_size:
+                        self._resolve_cache.popitem(last=False)
+
+        shelves = {}
+        for item, term in terms.items():
+            if resolved[term] is not None:
+                shelves.setdefault(resolved[term], []).append(item)
+        return shelves
+
+    def _resolve_terms(self, terms):
+        """Look up the most common shelf of every term, returning (term, shelf id) pairs"""
+        values = ', '.join(['(?, ?, ?, ?)'] * len(terms))
+        params = []
+        for term in terms:
+            params += [term, '"' + term.replace('"', '""') + '"', f'%{term}%', len(term)]
+
+        query = f'''
+            WITH terms (term, phrase, pattern, length) AS (VALUES {values}),
+            matches AS (
+                SELECT terms.term, grocery_search.rowid AS id, bm25(grocery_search) AS score
+                FROM terms JOIN grocery_search
+                WHERE terms.length >= 3 AND grocery_search MATCH terms.phrase
+                UNION ALL
+                SELECT terms.term, grocery_search.rowid AS id, 0 AS score
+                FROM terms JOIN grocery_search
+                WHERE terms.length < 3 AND (grocery_search.name LIKE terms.pattern OR grocery_search.category LIKE terms.pattern)
+            ),
+            shelves AS (
+                SELECT matches.term, groceries.shelf_id,
+                       ROW_NUMBER() OVER (PARTITION BY matches.term ORDER BY COUNT(*) DESC, MIN(matches.score)) AS rank
+                FROM matches
+                JOIN groceries ON groceries.id = matches.id
+                GROUP BY matches.term, groceries.shelf_id
+            )
+            SELECT term, shelf_id FROM shelves WHERE rank = 1
+        '''
+        return self._query(query, params, row_factory=None)
 
 
 if __name__ == '__main__':
@@ -130,22 +372,7 @@ if __name__ == '__main__':
     cursor = conn.cursor()
 
     # Create tables for categories and groceries
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL UNIQUE
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS groceries (
-            id INTEGER PRIMARY KEY,
-            shelf_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            category_id INTEGER NOT NULL,
-            FOREIGN KEY (category_id) REFERENCES categories(id)
-        )
-    ''')
+    create_schema(cursor)
 
     # List of German category names
     categories = [
@@ -0,0 +1,311 @@
+import copy
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+
+import numpy as np
+
+import metrics
+from pathfinder import UNREACHABLE, DistanceMatrix, bfs
+
+# tile types that are always precomputed as route endpoints besides the shelves
+ENDPOINT_TYPES = {"cash-register", "wall-door-rotate", "fence-door-rotate"}
+# layouts kept in the database besides the one in use, and how long an unused one is kept
+MAX_LAYOUTS = 8
+LAYOUT_MAX_AGE = 30 * 24 * 3600
+
+
+def pickup_ids(tiles):
+    """Return the ids of all tiles that can be part of a route (shelves, entrances and registers)"""
+    return [
+        tile['id'] for tile in tiles
+        if tile.get('shelf_id') is not None or tile.get('type') in ENDPOINT_TYPES
+    ]
+
+
+def _pack(values):
+    return zlib.compress(np.ascontiguousarray(values, dtype=np.int32).tobytes(), 1)
+
+
+def _unpack(blob):
+    return np.frombuffer(zlib.decompress(blob), dtype=np.int32)
+
+
+def _pack_matrix(matrix):
+    """Pack the lower triangle of a symmetric distance matrix"""
+    return _pack(matrix[np.tril_indices(len(matrix))])
+
+
+def _unpack_matrix(blob, size):
+    matrix = np.empty((size, size), dtype=np.int32)
+    rows, columns = np.tril_indices(size)
+    matrix[rows, columns] = matrix[columns, rows] = _unpack(blob)
+    return matrix
+
+
+def changed_edges(old_adjacency, new_adjacency):
+    """List the (cell, old neighbor, new neighbor) adjacency slots that differ between two layouts"""
+    old_adjacency, new_adjacency = np.asarray(old_adjacency), np.asarray(new_adjacency)
+    return [
+        (int(slot) // 4, int(old_adjacency[slot]), int(new_adjacency[slot]))
+        for slot in np.flatnonzero(old_adjacency != new_adjacency)
+    ]
+
+
+def earlier_layout(graph, adjacency):
+    """Copy of a graph with the adjacency table of another layout of the same grid, enough to search it with bfs.
+
+    Cells with edges of their own count as walkable. Any other cell is only
+    left as the source of a search, through the edges leading into it.
+    """
+    earlier = copy.copy(graph)
+    earlier.adjacency = array('i', np.asarray(adjacency, dtype=np.int32).tobytes())
+    earlier.walkable = bytearray(np.asarray(earlier.adjacency).reshape(-1, 4).max(axis=1) >= 0)
+    earlier._layout_key = None
+    return earlier
+
+
+def _distances_from(graph, cell, sources):
+    """Distances from a cell to the given source cells, UNREACHABLE if there is no path"""
+    dist = np.asarray(bfs(cell, graph)[0])[sources]
+    return np.where(dist < 0, UNREACHABLE, dist).astype(np.int32)
+
+
+def _distances_through(graph, cell, sources):
+    """Distances from the sources to a cell for paths that may continue from it.
+
+    Paths only end at a cell without edges of their own, unless they start there.
+    """
+    if max(graph.adjacency[4 * cell:4 * cell + 4]) != -1:
+        return _distances_from(graph, cell, sources)
+    return np.where(sources == cell, 0, UNREACHABLE).astype(np.int32)
+
+
+def _cover(pairs):
+    """Pick rows of a symmetric mask so that every marked pair has one of them, greedily by the most pairs left"""
+    pairs = pairs.copy()
+    counts = pairs.sum(axis=1)
+    rows = []
+    while counts.any():
+        row = int(counts.argmax())
+        rows.append(row)
+        counts -= pairs[:, row]
+        counts[row] = 0
+        pairs[:, row] = pairs[row] = False
+    return rows
+
+
+def update_distances(matrix, sources, before, after, changes):
+    """Update the distances between sources from one layout of a grid to another.
+
+    ``before`` and ``after`` are the graphs of both layouts and ``changes``
+    the adjacency slots that differ. Distances are symmetric, so one BFS from
+    each end of a changed edge gives the distance of every pair through it.
+    Removing an edge can only lengthen the distance of pairs with a shortest
+    path through it, and those get a BFS on the new layout from one of their
+    sources, picked to cover all of them with few searches. Adding an edge can
+    only shorten a distance to the one through it. Returns the new matrix and
+    the recomputed sources.
+    """
+    cells = np.array(sources, dtype=np.int64)
+    ends = {}
+    lengthened = np.zeros(matrix.shape, dtype=bool)
+    for cell, old, _ in changes:
+        if old == -1:
+            continue
+        for end in (cell, old):
+            if end not in ends:
+                ends[end] = _distances_through(before, end, cells)
+        lengthened |= ends[cell][:, None] + 1 + ends[old][None, :] == matrix
+    recomputed = _cover(lengthened | lengthened.T)
+
+    matrix = matrix.copy()
+    for row in recomputed:
+        matrix[row] = matrix[:, row] = _distances_from(after, sources[row], cells)
+    ends = {}
+    for cell, _, new in changes:
+        if new == -1:
+            continue
+        for end in (cell, new):
+            if end not in ends:
+                ends[end] = _distances_through(after, end, cells)
+        through = ends[cell][:, None] + 1 + ends[new][None, :]
+        np.minimum(matrix, np.minimum(through, through.T), out=matrix)
+    return matrix, [sources[row] for row in recomputed]
+
+
+class DistanceCache:
+    """Persistent store of the distances between the sources of each store layout.
+
+    The sources of a layout are the tiles routes are planned between, and the
+    distances between all of them are kept as one symmetric matrix in SQLite
+    next to the grocery tables, so a request only has to look values up. It
+    takes memory and storage for sources squared instead of a BFS tree of the
+    whole store per source, and the tile paths of a route are searched when it
+    is drawn. A new source costs one BFS. Replaced layouts are kept, so
+    switching back reuses their distances, until more than ``max_layouts`` are
+    stored or one has not been used for ``max_age`` seconds.
+    """
+
+    def __init__(self, db_path='grocery_store.db', max_layouts=MAX_LAYOUTS, max_age=LAYOUT_MAX_AGE):
+        self.db_path = db_path
+        self.max_layouts = max_layouts
+        self.max_age = max_age
+        self.layouts = {}  # layout key -> (source cell -> matrix row, distances between the sources)
+        self.lock = threading.Lock()  # requests may add missing sources concurrently
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS layouts (
+                    layout_key TEXT PRIMARY KEY,
+                    width INTEGER NOT NULL,
+                    height INTEGER NOT NULL,
+                    adjacency BLOB NOT NULL,
+                    created REAL NOT NULL,
+                    used REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            if 'used' not in {row[1] for row in conn.execute('PRAGMA table_info(layouts)')}:
+                conn.execute('ALTER TABLE layouts ADD COLUMN used REAL NOT NULL DEFAULT 0')
+            # BFS trees used to be stored per source, the distances between the sources replace them
+            for table in ('distance_trees', 'layout_trees', 'trees'):
+                conn.execute(f'DROP TABLE IF EXISTS {table}')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS layout_distances (
+                    layout_key TEXT PRIMARY KEY,
+                    sources BLOB NOT NULL,
+                    distances BLOB NOT NULL,
+                    FOREIGN KEY (layout_key) REFERENCES layouts(layout_key)
+                )
+            ''')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path)
+
+    def _store(self, cursor, key):
+        index, matrix = self.layouts[key]
+        cursor.execute('''
+            INSERT OR REPLACE INTO layout_distances (layout_key, sources, distances) VALUES (?, ?, ?)
+        ''', (key, _pack(list(index)), _pack_matrix(matrix)))
+
+    def _use_layout(self, cursor, graph, key):
+        """Register a layout or mark it as used now, then expire layouts that are no longer kept"""
+        now = time.time()
+        cursor.execute('''
+            INSERT INTO layouts (layout_key, width, height, adjacency, created, used)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (layout_key) DO UPDATE SET used = excluded.used
+        ''', (key, graph.width, graph.height, _pack(graph.adjacency), now, now))
+        cursor.execute('''
+            SELECT layout_key FROM layouts
+            WHERE layout_key != ? AND (used < ? OR layout_key NOT IN (
+                SELECT layout_key FROM layouts ORDER BY used DESC LIMIT ?
+            ))
+        ''', (key, now - self.max_age, self.max_layouts + 1))
+        for (old_key,) in cursor.fetchall():
+            cursor.execute('DELETE FROM layout_distances WHERE layout_key = ?', (old_key,))
+            cursor.execute('DELETE FROM layouts WHERE layout_key = ?', (old_key,))
+            self.layouts.pop(old_key, None)
+
+    def load_layout(self, graph, source_ids, parent=None):
+        """Make sure the distances between all sources of a layout are cached and loaded into memory.
+
+        A layout that is not stored yet starts from the distances of the
+        ``parent`` layout key, updated to the changed edges, if it is given and
+        stored. Returns the number of sources whose distances had to be computed.
+        """
+        key = graph.layout_key()
+        computed = 0
+        with self.lock, self._connect() as conn:
+            cursor = conn.cursor()
+            if key not in self.layouts:
+                cursor.execute('SELECT 1 FROM layouts WHERE layout_key = ?', (key,))
+                if cursor.fetchone() is None and parent is not None:
+                    computed += self._migrate(cursor, graph, key, parent)
+                self._use_layout(cursor, graph, key)
+                cursor.execute('SELECT sources, distances FROM layout_distances WHERE layout_key = ?', (key,))
+                row = cursor.fetchone()
+                sources = _unpack(row[0]).tolist() if row else []
+                matrix = _unpack_matrix(row[1], len(sources)) if row else np.zeros((0, 0), dtype=np.int32)
+                self.layouts[key] = ({cell: i for i, cell in enumerate(sources)}, matrix)
+                metrics.count('distance_rows', len(sources), source='database')
+
+            index, matrix = self.layouts[key]
+            missing = sorted({graph.cell_of[tile_id] for tile_id in source_ids} - index.keys())
+            if missing:
+                self.layouts[key] = self._extend(graph, index, matrix, missing)
+                self._store(cursor, key)
+        return computed + len(missing)
+
+    @staticmethod
+    def _extend(graph, index, matrix, cells):
+        """Add sources to a distance matrix with one BFS each, distances are symmetric"""
+        sources = list(index) + cells
+        targets = np.array(sources, dtype=np.int64)
+        extended = np.empty((len(sources), len(sources)), dtype=np.int32)
+        extended[:len(index), :len(index)] = matrix
+        for row, cell in enumerate(cells, len(index)):
+            extended[row] = extended[:, row] = _distances_from(graph, cell, targets)
+        metrics.count('distance_rows', len(cells), source='computed')
+        return {cell: row for row, cell in enumerate(sources)}, extended
+
+    def _migrate(self, cursor, graph, key, parent):
+        """Store the distances of the parent layout, updated to the new one, for a new layout"""
+        cursor.execute('''
+            SELECT layouts.adjacency, layout_distances.sources, layout_distances.distances
+            FROM layouts JOIN layout_distances ON layout_distances.layout_key = layouts.layout_key
+            WHERE layouts.layout_key = ? AND layouts.width = ? AND layouts.height = ?
+        ''', (parent, graph.width, graph.height))
+        previous = cursor.fetchone()
+        if previous is None:
+            return 0
+
+        adjacency, sources = _unpack(previous[0]), _unpack(previous[1]).tolist()
+        changes = changed_edges(adjacency, graph.adjacency)
+        matrix, recomputed = update_distances(_unpack_matrix(previous[2], len(sources)), sources,
+                                              earlier_layout(graph, adjacency), graph, changes)
+        metrics.count('distance_rows', len(recomputed), source='computed')
+        cursor.execute('INSERT INTO layout_distances (layout_key, sources, distances) VALUES (?, ?, ?)',
+                       (key, previous[1], _pack_matrix(matrix)))
+        return len(recomputed)
+
+    def apply_edits(self, graph, types):
+        """Change tile types of a loaded layout in place and update the distances between its sources.
+
+        See update_distances: only sources that some pair with a longer
+        distance needs are searched again. The matrix is replaced by an updated
+        copy and written as the new layout, the old layout stays stored until
+        it expires. Returns ``(changed edges, recomputed sources)``.
+        """
+        old_key = graph.layout_key()
+        if old_key not in self.layouts:
+            self.load_layout(graph, [])
+        before = earlier_layout(graph, graph.adjacency)
+
+        changes = graph.set_tile_types(types)
+        key = graph.layout_key()
+        if key == old_key:
+            return changes, []
+
+        index, matrix = self.layouts.pop(old_key)
+        matrix, recomputed = update_distances(matrix, list(index), before, graph, changes)
+        metrics.count('distance_rows', len(recomputed), source='computed')
+        self.layouts[key] = (index, matrix)
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            self._use_layout(cursor, graph, key)
+            # the edit may return to a stored layout, whose distances are replaced by the ones in memory
+            self._store(cursor, key)
+        return changes, recomputed
+
+    def distances(self, ids, graph):
+        """Build the distance matrix for the given tiles from the cached distances, leg paths are searched on demand"""
+        key = graph.layout_key()
+        index = self.layouts[key][0] if key in self.layouts else {}
+        missing = [tile_id for tile_id in ids if graph.cell_of[tile_id] not in index]
+        if missing or key not in self.layouts:
+            self.load_layout(graph, missing)
+        index, matrix = self.layouts[key]
+        rows = [index[graph.cell_of[tile_id]] for tile_id in ids]
+        return DistanceMatrix.from_matrix(ids, matrix[np.ix_(rows, rows)], graph)
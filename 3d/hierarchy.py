@@ -0,0 +1,238 @@
+import heapq
+
+import numpy as np
+
+import metrics
+from pathfinder import UNREACHABLE, DistanceMatrix, a_star
+
+# Smallest cost of caching exact distances, tiles times distance sources (the cells visited by a BFS
+# per source, about 7s at 1.4M cells/s), for which the app routes on the hierarchical graph instead
+HIERARCHY_MIN_BFS_CELLS = 10_000_000
+
+# Entrances of at least this many tiles get a transition at both ends instead of one in the middle
+LONG_ENTRANCE = 6
+
+
+class HierarchicalGraph:
+    """Abstract graph over a StoreGraph for layouts too large for a BFS per stop (HPA*).
+
+    The grid is split into square clusters. Where walkable tiles of two
+    neighboring clusters touch, each run of open border pairs (an entrance)
+    gets one or two transitions, whose tiles become the nodes of the abstract
+    graph. Nodes are connected across the border with cost 1 and to the other
+    nodes of their cluster with the distance of a BFS inside the cluster,
+    computed once per layout.
+
+    A stop is attached to the nodes of its cluster with one more BFS inside
+    the cluster, so a distance matrix costs a cluster sized search and a
+    Dijkstra over the abstract graph per stop. Distances are exact within a
+    cluster and otherwise may be slightly longer than the shortest path,
+    since routes must cross borders at transitions.
+    """
+
+    def __init__(self, graph, cluster_size=16):
+        self.graph = graph
+        self.cluster_size = cluster_size
+        self.columns = -(-graph.width // cluster_size)
+        self.rows = -(-graph.height // cluster_size)
+        self.transitions = {}  # (cluster, right or lower cluster) -> [(cell, cell across the border)]
+        self.intra = {}  # cluster -> {node: [(other node, distance)]}
+        self.inter = {}  # node -> [node across the border]
+        self.update(range(self.columns * self.rows))
+
+    def cluster_of(self, cell):
+        y, x = divmod(cell, self.graph.width)
+        return (y // self.cluster_size) * self.columns + x // self.cluster_size
+
+    def _bounds(self, cluster):
+        """Return the x range and y range of a cluster"""
+        row, column = divmod(cluster, self.columns)
+        size = self.cluster_size
+        return (range(column * size, min((column + 1) * size, self.graph.width)),
+                range(row * size, min((row + 1) * size, self.graph.height)))
+
+    def _border_transitions(self, cluster, other):
+        """Find the entrances between a cluster and its right or lower neighbor and pick their transitions"""
+        graph = self.graph
+        xs, ys = self._bounds(cluster)
+        if other == cluster + 1:  # right neighbor, border pairs along the last column
+            pairs = [(y * graph.width + xs[-1], y * graph.width + xs[-1] + 1) for y in ys]
+            slot = 1
+        else:  # lower neighbor, border pairs along the last row
+            pairs = [(ys[-1] * graph.width + x, (ys[-1] + 1) * graph.width + x) for x in xs]
+            slot = 3
+
+        transitions = []
+        run = []
+        for a, b in pairs + [(-1, -1)]:
+            if a != -1 and graph.adjacency[4 * a + slot] == b and graph.walkable[b]:
+                run.append((a, b))
+                continue
+            if len(run) >= LONG_ENTRANCE:
+                transitions += [run[0], run[-1]]
+            elif run:
+                transitions.append(run[len(run) // 2])
+            run = []
+        return transitions
+
+    def _search(self, starts, distance, clusters):
+        """BFS from cells at the same distance that only expands walkable cells of the given clusters.
+
+        Fixtures next to an expanded cell are reached in any cluster. Returns
+        the distance per reached cell.
+        """
+        graph = self.graph
+        adjacency = graph.adjacency
+        walkable = graph.walkable
+        dist = dict.fromkeys(starts, distance)
+        frontier = list(dist)
+        while frontier:
+            distance += 1
+            next_frontier = []
+            for cell in frontier:
+                if not walkable[cell]:
+                    continue
+                for neighbor in adjacency[4 * cell:4 * cell + 4]:
+                    if neighbor == -1 or neighbor in dist:
+                        continue
+                    if walkable[neighbor] and self.cluster_of(neighbor) not in clusters:
+                        continue
+                    dist[neighbor] = distance
+                    next_frontier.append(neighbor)
+            frontier = next_frontier
+        return dist
+
+    def update(self, clusters):
+        """Recompute transitions and intra-cluster distances around the given clusters, e.g. after an edit"""
+        affected = set()
+        for cluster in clusters:
+            row, column = divmod(cluster, self.columns)
+            affected.add(cluster)
+            if column + 1 < self.columns:
+                affected.add(cluster + 1)
+            if column > 0:
+                affected.add(cluster - 1)
+            if row + 1 < self.rows:
+                affected.add(cluster + self.columns)
+            if row > 0:
+                affected.add(cluster - self.columns)
+
+        for cluster in clusters:
+            row, column = divmod(cluster, self.columns)
+            borders = [(cluster - 1, cluster)] if column > 0 else []
+            borders += [(cluster - self.columns, cluster)] if row > 0 else []
+            borders += [(cluster, cluster + 1)] if column + 1 < self.columns else []
+            borders += [(cluster, cluster + self.columns)] if row + 1 < self.rows else []
+            for border in borders:
+                self.transitions[border] = self._border_transitions(*border)
+
+        self.inter = {}
+        nodes = {cluster: set() for cluster in affected}
+        for transitions in self.transitions.values():
+            for a, b in transitions:
+                self.inter.setdefault(a, []).append(b)
+                self.inter.setdefault(b, []).append(a)
+                for cell in (a, b):
+                    cluster = self.cluster_of(cell)
+                    if cluster in nodes:
+                        nodes[cluster].add(cell)
+
+        for cluster, cluster_nodes in nodes.items():
+            edges = {}
+            for node in cluster_nodes:
+                dist = self._search([node], 0, {cluster})
+                edges[node] = [(other, dist[other]) for other in cluster_nodes if other != node and other in dist]
+            self.intra[cluster] = edges
+
+        # the abstract graph with nodes numbered, so searches index lists instead of hashing cells
+        self.nodes = [node for cluster_edges in self.intra.values() for node in cluster_edges]
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+        self.edges = [
+            [(self.node_index[other], cost) for other, cost in self.intra[self.cluster_of(node)][node]]
+            + [(self.node_index[other], 1) for other in self.inter.get(node, ()) if other in self.node_index]
+            for node in self.nodes
+        ]
+        metrics.count('hierarchy_clusters_built', len(nodes))
+
+    def _attach(self, cell):
+        """Distances from a stop to all cells around it within the clusters of its exits"""
+        if self.graph.walkable[cell]:
+            return self._search([cell], 0, {self.cluster_of(cell)})
+        exits = list(self.graph.exits(cell))
+        dist = self._search(exits, 1, {self.cluster_of(exit) for exit in exits})
+        dist[cell] = 0
+        return dist
+
+    def _node_distances(self, local):
+        """Pick the abstract nodes out of a local search result"""
+        clusters = {self.cluster_of(cell) for cell in local if self.graph.walkable[cell]}
+        return {node: local[node] for cluster in clusters for node in self.intra.get(cluster, ()) if node in local}
+
+    def distances(self, ids):
+        """Build the distance matrix between tiles on the abstract graph"""
+        graph = self.graph
+        cells = [graph.cell_of[tile_id] for tile_id in ids]
+        local = [self._attach(cell) for cell in cells]
+        attached = [self._node_distances(dist) for dist in local]
+
+        # targets per abstract node, to settle targets while the search runs
+        targets_at = [[] for _ in self.nodes]
+        for target, nodes in enumerate(attached):
+            for node, distance in nodes.items():
+                targets_at[self.node_index[node]].append((target, distance))
+
+        matrix = np.full((len(cells), len(cells)), UNREACHABLE, dtype=np.int32)
+        np.fill_diagonal(matrix, 0)
+        settled_nodes = 0
+        for row in range(len(cells)):
+            # distances are symmetric, so each row only searches for the stops after it
+            best = {target: local[row].get(cells[target], UNREACHABLE) for target in range(row + 1, len(cells))}
+            worst = max(best.values(), default=0)
+
+            # Dijkstra over the abstract graph, stopped once no target can improve
+            dist = [UNREACHABLE] * len(self.nodes)
+            heap = []
+            for node, distance in attached[row].items():
+                dist[self.node_index[node]] = distance
+                heap.append((distance, self.node_index[node]))
+            heapq.heapify(heap)
+            while heap:
+                distance, node = heapq.heappop(heap)
+                if distance >= worst:
+                    break
+                if distance > dist[node]:
+                    continue
+                settled_nodes += 1
+                improved = False
+                for target, to_target in targets_at[node]:
+                    if target > row and distance + to_target < best[target]:
+                        best[target] = distance + to_target
+                        improved = True
+                if improved:
+                    worst = max(best.values())
+                for other, cost in self.edges[node]:
+                    if distance + cost < dist[other]:
+                        dist[other] = distance + cost
+                        heapq.heappush(heap, (distance + cost, other))
+            for target, distance in best.items():
+                matrix[row, target] = matrix[target, row] = distance
+        metrics.count('hierarchy_nodes_settled', settled_nodes)
+        return HierarchicalDistances(ids, matrix, graph)
+
+
+class HierarchicalDistances(DistanceMatrix):
+    """Distance matrix from the abstract graph, refining tile paths with A* only for legs that are drawn"""
+
+    approximate = True
+
+    def __init__(self, ids, matrix, graph):
+        self.ids = list(ids)
+        self.graph = graph
+        self.index = {tile_id: i for i, tile_id in enumerate(self.ids)}
+        self.predecessors = {}
+        self.matrix = matrix
+
+    def path(self, id1, id2):
+        if self[id1, id2] >= UNREACHABLE:
+            return []
+        return a_star(id1, id2, self.graph)
@@ -0,0 +1,124 @@
+"""Bulk import of a store assortment into the grocery database.
+
+Reads a CSV file (with a header) or a JSONL file with one product per line,
+each having ``name``, ``category`` and ``shelf_id`` and optionally an ``id``.
+Rows with an id are upserted, so an export can be re-imported to update an
+existing catalog. Run from the ``3d`` folder:
+
+    python importer.py products.csv --db grocery_store.db
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+import time
+from itertools import islice
+
+from db import create_schema, rebuild_search_index
+
+# triggers and indexes dropped during the import and recreated by create_schema afterwards
+DEFERRED_TRIGGERS = [
+    "groceries_search_insert", "groceries_search_delete", "groceries_search_update", "categories_search_update",
+] + [f"{table}_version_{event}" for table in ("groceries", "categories") for event in ("insert", "update", "delete")]
+DEFERRED_INDEXES = ["idx_groceries_shelf_id", "idx_groceries_category_id"]
+
+
+def read_rows(path):
+    """Stream (id, name, category, shelf_id) tuples from a CSV or JSONL file"""
+    with open(path, newline='', encoding='utf-8') as file:
+        if path.endswith('.jsonl'):
+            records = (json.loads(line) for line in file if line.strip())
+        else:
+            records = csv.DictReader(file)
+        for record in records:
+            grocery_id = record.get('id')
+            yield (
+                int(grocery_id) if grocery_id not in (None, '') else None,
+                record['name'],
+                record['category'],
+                int(record['shelf_id']),
+            )
+
+
+def batched(rows, size):
+    """Split a row stream into lists of at most `size` rows"""
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def import_catalog(rows, db_path='grocery_store.db', batch_size=10000, defer_indexes=True, report=sys.stderr):
+    """Import grocery rows in batches inside a single transaction.
+
+    Index maintenance is deferred: the secondary indexes and the triggers
+    feeding the search index and catalog version are dropped for the import
+    and rebuilt once at the end. Small incremental imports can pass
+    ``defer_indexes=False`` to keep them maintained row by row instead of
+    rebuilding everything. Returns the number of imported rows.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    cursor = conn.cursor()
+    create_schema(cursor)
+    cursor.execute('PRAGMA journal_mode = WAL')
+    cursor.execute('PRAGMA synchronous = NORMAL')
+
+    began = time.perf_counter()
+    total = 0
+    cursor.execute('BEGIN')
+    try:
+        if defer_indexes:
+            for name in DEFERRED_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            for name in DEFERRED_INDEXES:
+                cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+        category_ids = dict(cursor.execute('SELECT name, id FROM categories'))
+        for batch in batched(rows, batch_size):
+            new_categories = {row[2] for row in batch} - category_ids.keys()
+            if new_categories:
+                cursor.executemany('INSERT INTO categories (name) VALUES (?)', [(name,) for name in new_categories])
+                placeholders = ', '.join('?' * len(new_categories))
+                category_ids.update(cursor.execute(
+                    f'SELECT name, id FROM categories WHERE name IN ({placeholders})', list(new_categories)))
+
+            cursor.executemany('''
+                INSERT INTO groceries (id, shelf_id, name, category_id) VALUES (?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    shelf_id = excluded.shelf_id, name = excluded.name, category_id = excluded.category_id
+            ''', [(grocery_id, shelf_id, name, category_ids[category]) for grocery_id, name, category, shelf_id in batch])
+
+            total += len(batch)
+            if report is not None:
+                elapsed = time.perf_counter() - began
+                print(f"{total} rows, {total / elapsed:.0f} rows/s", file=report, flush=True)
+
+        if defer_indexes:
+            # Recreate indexes and triggers, then rebuild what they would have maintained
+            create_schema(cursor)
+            rebuild_search_index(cursor)
+            cursor.execute('UPDATE catalog_version SET version = version + 1')
+        cursor.execute('COMMIT')
+    except BaseException:
+        cursor.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+    if report is not None:
+        elapsed = time.perf_counter() - began
+        print(f"imported {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)", file=report)
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk import a CSV or JSONL product export into the grocery database")
+    parser.add_argument('path', help="CSV file with a header or JSONL file")
+    parser.add_argument('--db', default='grocery_store.db', help="database to import into")
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--incremental', action='store_true',
+                        help="keep indexes live instead of rebuilding them, faster for small updates")
+    args = parser.parse_args()
+
+    import_catalog(read_rows(args.path), db_path=args.db, batch_size=args.batch_size,
+                   defer_indexes=not args.incremental)
@@ -0,0 +1,127 @@
+import queue
+import threading
+import time
+import uuid
+
+# states a job ends in
+FINISHED = {'done', 'failed', 'cancelled'}
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+class Job:
+    """A queued solve with its state, the best route so far and the final result.
+
+    Every change bumps ``version`` and wakes up waiters, so readers can follow
+    a job without polling.
+    """
+
+    def __init__(self, run):
+        self.id = uuid.uuid4().hex
+        self.run = run
+        self.status = 'queued'
+        self.best = None
+        self.result = None
+        self.error = None
+        self.version = 0
+        self.finished_at = None
+        self.cancelled = threading.Event()
+        self.changed = threading.Condition()
+
+    def _update(self, **fields):
+        with self.changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self.changed.notify_all()
+
+    def publish(self, best):
+        """Report an intermediate route while the job is running"""
+        self._update(best=best)
+
+    def cancel(self):
+        self.cancelled.set()
+        with self.changed:
+            if self.status == 'queued':
+                self.status = 'cancelled'
+                self.finished_at = time.monotonic()
+                self.version += 1
+                self.changed.notify_all()
+
+    def wait(self, version, timeout=None):
+        """Block until the job changed after `version` or finished, returning the current version"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version > version or self.status in FINISHED, timeout)
+            return self.version
+
+    def as_dict(self):
+        with self.changed:
+            return {
+                'id': self.id,
+                'status': self.status,
+                'best': self.best,
+                'result': self.result,
+                'error': self.error,
+            }
+
+
+class JobQueue:
+    """In-process queue running jobs on a fixed number of worker threads.
+
+    At most ``max_pending`` jobs wait for a worker; beyond that submit raises
+    QueueFull so callers can push back on clients. Finished jobs are kept for
+    ``keep_seconds`` to be fetched, then dropped.
+    """
+
+    def __init__(self, workers=2, max_pending=16, keep_seconds=300):
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.keep_seconds = keep_seconds
+        self.threads = [
+            threading.Thread(target=self._work, name=f'solve-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, run):
+        """Queue ``run(job)``, whose return value becomes the job result"""
+        self._prune()
+        job = Job(run)
+        with self.lock:
+            self.jobs[job.id] = job
+        try:
+            self.pending.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job.id]
+            raise QueueFull(f"{self.pending.maxsize} jobs are already waiting")
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.keep_seconds
+        with self.lock:
+            for job_id in [job_id for job_id, job in self.jobs.items()
+                           if job.finished_at is not None and job.finished_at < cutoff]:
+                del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self.pending.get()
+            if job.cancelled.is_set():
+                continue  # cancelled while waiting
+            job._update(status='running')
+            try:
+                result = job.run(job)
+            except Exception as error:
+                job._update(status='failed', error=str(error), finished_at=time.monotonic())
+            else:
+                status = 'cancelled' if job.cancelled.is_set() else 'done'
+                job._update(status=status, result=result, finished_at=time.monotonic())
@@ -0,0 +1,119 @@
+import gzip
+import hashlib
+import json
+import threading
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# content encodings available, preferred first
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+# compression levels per encoding: smallest output, and a quicker one for large bodies requested rarely
+BEST = {'br': 11, 'gzip': 9}
+FAST = {'br': 5, 'gzip': 6}
+
+
+def compress(body, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def compress_variants(body, levels=BEST):
+    """Precompress a response body with every content encoding available"""
+    return {encoding: compress(body, encoding, levels[encoding]) for encoding in ENCODINGS}
+
+
+def pick_variant(body, etag, variants, accept_encodings):
+    """Return the smallest (content encoding, body, etag) the client accepts.
+
+    Every encoding is its own representation and gets its own strong ETag.
+    """
+    candidates = [(None, body, etag)] + [
+        (encoding, compressed, f'{etag}-{encoding}')
+        for encoding, compressed in variants.items() if accept_encodings[encoding]
+    ]
+    return min(candidates, key=lambda candidate: len(candidate[1]))
+
+
+def run_length_encode(values):
+    """Encode a sequence as a flat [value, run, value, run, ...] list"""
+    runs = []
+    for value in values:
+        if runs and runs[-2] == value:
+            runs[-1] += 1
+        else:
+            runs += [value, 1]
+    return runs
+
+
+def encode_tiles(tiles):
+    """Encode the tile list column by column over the flat map grid.
+
+    Types become indexes into a type dictionary (-1 for cells without a tile)
+    and, like rotations, are run-length encoded in row-major cell order, so
+    long runs of empty floor cost a few bytes. Tile ids are left out when they
+    equal the cell index and shelf ids are stored sparsely.
+    """
+    min_x = min(tile['x'] for tile in tiles)
+    min_y = min(tile['y'] for tile in tiles)
+    width = max(tile['x'] for tile in tiles) - min_x + 1
+    height = max(tile['y'] for tile in tiles) - min_y + 1
+
+    grid = [None] * (width * height)
+    for tile in tiles:
+        grid[(tile['y'] - min_y) * width + tile['x'] - min_x] = tile
+    present = [tile for tile in grid if tile is not None]
+
+    types = list(dict.fromkeys(tile.get('type') for tile in present))
+    type_index = {tile_type: i for i, tile_type in enumerate(types)}
+    ids = [tile['id'] for tile in present]
+    cells = [cell for cell, tile in enumerate(grid) if tile is not None]
+
+    return {
+        "format": "columnar",
+        "min_x": min_x,
+        "min_y": min_y,
+        "width": width,
+        "height": height,
+        "types": types,
+        "type": run_length_encode(type_index[tile.get('type')] if tile else -1 for tile in grid),
+        "rotation": run_length_encode(tile.get('rotation') if tile else None for tile in grid),
+        "ids": None if ids == cells else ids,
+        "shelf_id": {
+            str(cell): grid[cell]['shelf_id'] for cell in cells if grid[cell].get('shelf_id') is not None
+        },
+    }
+
+
+class EncodedMap:
+    """Map data of one layout version, serialized once and compressed on first use.
+
+    Holds the JSON body with a strong ETag derived from it. Publishing a
+    layout only serializes it, each content encoding is compressed with
+    ``levels`` the first time a client accepts it and kept for later requests.
+    """
+
+    def __init__(self, tiles, columnar=True, levels=BEST):
+        data = encode_tiles(tiles) if columnar else {"tiles": tiles}
+        self.body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self.levels = levels
+        self.variants = {}
+        self.lock = threading.Lock()  # concurrent first requests compress once
+
+    def variant(self, encoding):
+        with self.lock:
+            if encoding not in self.variants:
+                self.variants[encoding] = compress(self.body, encoding, self.levels[encoding])
+            return self.variants[encoding]
+
+    def pick(self, accept_encodings):
+        """Use the preferred encoding the client accepts, unless it does not make the body smaller"""
+        for encoding in ENCODINGS:
+            if accept_encodings[encoding]:
+                return pick_variant(self.body, self.etag, {encoding: self.variant(encoding)}, accept_encodings)
+        return None, self.body, self.etag
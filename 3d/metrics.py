@@ -0,0 +1,134 @@
+"""Counters and stage timings of the routing pipeline.
+
+Hot loops count into local variables and report once per call, so recording
+costs a dictionary update per search rather than per node. Totals are
+exported in the Prometheus text format by ``render``. Within ``profiling()``,
+the stages and counters of the current request are also collected separately.
+Worker processes gather their counters with ``collecting()`` and return them,
+so the parent can ``add`` them to its totals. Setting ``enabled`` to False
+turns recording into a no-op.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+enabled = True
+
+# description per metric for the # HELP lines
+HELP = {
+    'stage_seconds': "Time spent in each stage of the routing pipeline",
+    'astar_nodes_expanded': "Nodes expanded by A* searches",
+    'astar_heap_pushes': "Heap pushes of A* searches",
+    'jps_jump_points_expanded': "Jump points expanded by jump point searches",
+    'jps_heap_pushes': "Heap pushes of jump point searches",
+    'bfs_trees': "Breadth-first search trees computed",
+    'bfs_cells_visited': "Cells visited by breadth-first searches",
+    'tsp_permutations': "Permutations evaluated by the brute force solver",
+    'tsp_dp_states': "Dynamic programming transitions evaluated by Held-Karp",
+    'tsp_search_nodes': "Search nodes visited by branch and bound",
+    'tsp_local_search_iterations': "Improvement passes of local search, each applying at most one move",
+    'route_cache_requests': "Route cache lookups by result",
+    'distance_rows': "Rows of cached distance matrices loaded from the database or computed",
+    'resolve_cache_requests': "Shopping list resolution cache lookups by result",
+    'hierarchy_clusters_built': "Clusters of the hierarchical graph whose transitions and distances were computed",
+    'hierarchy_nodes_settled': "Abstract nodes settled by hierarchical distance queries",
+}
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_timings = {}  # (name, labels) -> [seconds, count]
+_profile = contextvars.ContextVar('profile', default=None)
+_collected = contextvars.ContextVar('collected', default=None)
+
+
+def _label_text(labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}' if labels else ''
+
+
+def count(name, value=1, **labels):
+    """Add to a counter, labels distinguish series of the same counter"""
+    if not enabled or not value:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    profile = _profile.get()
+    if profile is not None:
+        series = name + _label_text(key[1])
+        profile['counters'][series] = profile['counters'].get(series, 0) + value
+    collected = _collected.get()
+    if collected is not None:
+        collected[key] = collected.get(key, 0) + value
+
+
+def add(counters):
+    """Add counters gathered by ``collecting``, e.g. in a worker process"""
+    for (name, labels), value in counters.items():
+        count(name, value, **dict(labels))
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage of the pipeline"""
+    if not enabled:
+        yield
+        return
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - began
+        with _lock:
+            timing = _timings.setdefault(('stage_seconds', (('stage', name),)), [0.0, 0])
+            timing[0] += elapsed
+            timing[1] += 1
+        profile = _profile.get()
+        if profile is not None:
+            profile['stages'].append({'stage': name, 'ms': elapsed * 1000})
+
+
+@contextmanager
+def profiling():
+    """Collect the stages and counters recorded in this context into the yielded dict"""
+    profile = {'stages': [], 'counters': {}}
+    token = _profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _profile.reset(token)
+
+
+@contextmanager
+def collecting():
+    """Gather the counters recorded in this context into the yielded dict of (name, labels) -> value"""
+    collected = {}
+    token = _collected.set(collected)
+    try:
+        yield collected
+    finally:
+        _collected.reset(token)
+
+
+def render(prefix='routing_'):
+    """Export all metrics in the Prometheus text format"""
+    with _lock:
+        counters = sorted(_counters.items())
+        timings = sorted(_timings.items())
+
+    lines = []
+    described = set()
+    for (name, labels), value in counters:
+        metric = f'{prefix}{name}_total'
+        if metric not in described:
+            described.add(metric)
+            lines += [f'# HELP {metric} {HELP.get(name, name)}', f'# TYPE {metric} counter']
+        lines.append(f'{metric}{_label_text(labels)} {value}')
+    for (name, labels), (seconds, calls) in timings:
+        metric = f'{prefix}{name}'
+        if metric not in described:
+            described.add(metric)
+            lines += [f'# HELP {metric} {HELP.get(name, name)}', f'# TYPE {metric} summary']
+        lines.append(f'{metric}_sum{_label_text(labels)} {seconds:.6f}')
+        lines.append(f'{metric}_count{_label_text(labels)} {calls}')
+    return '\n'.join(lines) + '\n'
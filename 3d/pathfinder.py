@@ -1,79 +1,407 @@
 
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import hashlib
 from itertools import permutations
+from math import factorial
 import heapq
+import threading
+import time
+import multiprocessing
+from multiprocessing import shared_memory
 
+import numpy as np
 
-def heuristic(a, b):
-    """Heuristic function for A* (Manhattan distance)"""
-    return abs(a['x'] - b['x']) + abs(a['y'] - b['y'])
+import metrics
 
+# distance used for pairs of tiles that are not connected
+UNREACHABLE = 1 << 28
 
-def get_neighbors(tile, tile_dict):
-    """Generate neighboring tiles"""
-    x, y = tile['x'], tile['y']
-    neighbors = []
-    for dx, dy in [(-1, 0), (1, 0), (0, -1), (0, 1)]:  # left, right, up, down
-        neighbor_pos = (x + dx, y + dy)
-        # Find tile at the neighboring position
-        for neighbor in tile_dict.values():
-            if (neighbor['x'], neighbor['y']) == neighbor_pos:
-                neighbors.append(neighbor)
-                break
-    return neighbors
 
+# Tile types that cannot be walked on or entered at all
+BLOCKED_TYPES = {"wall", "wall-corner", "wall-window", "column", "fence"}
+
+# Tile types that can be walked through like an aisle, every other type is a fixture
+# (shelf, display, register, ...) that can only be entered from an adjacent aisle tile
+WALKABLE_TYPES = {None, "floor", "wall-door-rotate", "fence-door-rotate"}
+
+# neighbor slots of the adjacency table: left, right, up, down
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+
+class StoreGraph:
+    """Compact grid representation of a store layout.
+
+    Tiles are stored in a flat ``width * height`` grid, so looking up a tile by
+    position or the neighbors of a tile is O(1). Each cell only costs a tile id,
+    a walkable flag and four precomputed neighbor slots instead of one dict per
+    tile.
+
+    Only walkable tiles have outgoing edges. Fixtures are reachable from an
+    adjacent walkable tile but never walked through, and blocked tiles have no
+    edges at all.
+    """
+
+    def __init__(self, tiles):
+        self.min_x = min(tile['x'] for tile in tiles)
+        self.min_y = min(tile['y'] for tile in tiles)
+        self.width = max(tile['x'] for tile in tiles) - self.min_x + 1
+        self.height = max(tile['y'] for tile in tiles) - self.min_y + 1
+        cells = self.width * self.height
+
+        # tile id per cell, -1 for positions without a tile
+        self.ids = array('q', [-1]) * cells
+        self.cell_of = {}
+        # 1 for walkable tiles, 0 for fixtures, blocked tiles and empty cells
+        self.walkable = bytearray(cells)
+        self.blocked = bytearray(cells)
+        for tile in tiles:
+            cell = (tile['y'] - self.min_y) * self.width + tile['x'] - self.min_x
+            self.ids[cell] = tile['id']
+            self.cell_of[tile['id']] = cell
+            tile_type = tile.get('type')
+            self.walkable[cell] = tile_type in WALKABLE_TYPES
+            self.blocked[cell] = tile_type in BLOCKED_TYPES
+
+        # adjacency table: four neighbor cells per walkable cell, -1 if there is none
+        self.adjacency = array('i', [-1]) * (4 * cells)
+        for cell in self.cell_of.values():
+            self._link(cell)
+        self._layout_key = None
+
+    def __len__(self):
+        return len(self.cell_of)
+
+    def _grid_neighbors(self, cell):
+        """Cells next to a cell in slot order, -1 outside of the grid"""
+        y, x = divmod(cell, self.width)
+        return [
+            (y + dy) * self.width + x + dx if 0 <= x + dx < self.width and 0 <= y + dy < self.height else -1
+            for dx, dy in DIRECTIONS
+        ]
+
+    def _link(self, cell):
+        """Fill the adjacency slots of a cell from the walkable and blocked flags"""
+        for slot, neighbor in enumerate(self._grid_neighbors(cell)):
+            linked = (self.walkable[cell] and neighbor != -1 and self.ids[neighbor] != -1
+                      and not self.blocked[neighbor])
+            self.adjacency[4 * cell + slot] = neighbor if linked else -1
+
+    def set_tile_types(self, types):
+        """Change the types of tiles in place, e.g. to block an aisle or move a shelf.
+
+        ``types`` maps tile ids to their new type. Returns the adjacency slots
+        that changed as ``(cell, old neighbor, new neighbor)`` tuples.
+        """
+        affected = set()
+        for tile_id, tile_type in types.items():
+            cell = self.cell_of[tile_id]
+            self.walkable[cell] = tile_type in WALKABLE_TYPES
+            self.blocked[cell] = tile_type in BLOCKED_TYPES
+            affected.add(cell)
+            affected.update(neighbor for neighbor in self._grid_neighbors(cell) if neighbor != -1)
+
+        changes = []
+        for cell in sorted(affected):
+            old = self.adjacency[4 * cell:4 * cell + 4]
+            self._link(cell)
+            changes += [
+                (cell, old_neighbor, new_neighbor)
+                for old_neighbor, new_neighbor in zip(old, self.adjacency[4 * cell:4 * cell + 4])
+                if old_neighbor != new_neighbor
+            ]
+        self._layout_key = None
+        return changes
+
+    def layout_key(self):
+        """Hash of the walkable structure of the layout, used to key cached distances"""
+        if self._layout_key is None:
+            digest = hashlib.sha1()
+            digest.update(array('i', [self.min_x, self.min_y, self.width, self.height]).tobytes())
+            digest.update(self.walkable)
+            digest.update(self.adjacency.tobytes())
+            self._layout_key = digest.hexdigest()
+        return self._layout_key
+
+    def position(self, cell):
+        """Return the (x, y) map coordinates of a cell"""
+        y, x = divmod(cell, self.width)
+        return x + self.min_x, y + self.min_y
+
+    def coordinates(self, tile_id):
+        """Return the map coordinates of a tile as a dict for the frontend"""
+        x, y = self.position(self.cell_of[tile_id])
+        return {'x': x, 'y': y}
+
+    def neighbors(self, cell):
+        """Generate the cells that can be walked to from a walkable cell"""
+        for neighbor in self.adjacency[4 * cell:4 * cell + 4]:
+            if neighbor != -1:
+                yield neighbor
+
+    def exits(self, cell):
+        """Generate the cells a route starting at a cell can step to.
+
+        For walkable cells these are its neighbors, for fixtures the adjacent
+        walkable cells they can be reached from.
+        """
+        if self.walkable[cell]:
+            yield from self.neighbors(cell)
+            return
+        for slot, neighbor in enumerate(self._grid_neighbors(cell)):
+            # the neighbor's edge in the opposite direction leads into this cell
+            if neighbor != -1 and self.adjacency[4 * neighbor + (slot ^ 1)] == cell:
+                yield neighbor
 
-def a_star(start_id, goal_id, tile_dict):
+
+def heuristic(graph, a, b):
+    """Heuristic function for A* (Manhattan distance between two cells)"""
+    ay, ax = divmod(a, graph.width)
+    by, bx = divmod(b, graph.width)
+    return abs(ax - bx) + abs(ay - by)
+
+
+def a_star(start_id, goal_id, graph):
     """A* algorithm to find the shortest path between two tiles"""
-    start_tile = tile_dict[start_id]
-    goal_tile = tile_dict[goal_id]
+    start = graph.cell_of[start_id]
+    goal = graph.cell_of[goal_id]
 
     open_set = []
-    heapq.heappush(open_set, (0, start_id))
+    heapq.heappush(open_set, (heuristic(graph, start, goal), start))
     came_from = {}
-    g_score = {tile_id: float('inf') for tile_id in tile_dict}
-    g_score[start_id] = 0
-    f_score = {tile_id: float('inf') for tile_id in tile_dict}
-    f_score[start_id] = heuristic(start_tile, goal_tile)
+    g_score = {start: 0}
+    expanded = pushes = 0
 
     while open_set:
-        current_id = heapq.heappop(open_set)[1]
+        current = heapq.heappop(open_set)[1]
+        expanded += 1
 
-        if current_id == goal_id:
+        if current == goal:
+            metrics.count('astar_nodes_expanded', expanded)
+            metrics.count('astar_heap_pushes', pushes)
             # Reconstruct path
             path = []
-            while current_id in came_from:
-                path.append(current_id)
-                current_id = came_from[current_id]
+            while current in came_from:
+                path.append(graph.ids[current])
+                current = came_from[current]
             path.append(start_id)
             return path[::-1]  # Return reversed path
 
-        for neighbor in get_neighbors(tile_dict[current_id], tile_dict):
-            neighbor_id = neighbor['id']
-            tentative_g_score = g_score[current_id] + 1  # assume uniform cost
+        tentative_g_score = g_score[current] + 1  # assume uniform cost
+        for neighbor in graph.exits(current) if current == start else graph.neighbors(current):
+            if tentative_g_score < g_score.get(neighbor, float('inf')):
+                came_from[neighbor] = current
+                g_score[neighbor] = tentative_g_score
+                heapq.heappush(open_set, (tentative_g_score + heuristic(graph, neighbor, goal), neighbor))
+                pushes += 1
+
+    metrics.count('astar_nodes_expanded', expanded)
+    metrics.count('astar_heap_pushes', pushes)
+    return []  # Return empty if no path is found
+
+
+def jump_point_search(start_id, goal_id, graph):
+    """A* with jump point search for the uniform-cost 4-connected grid.
+
+    Straight runs along aisles are skipped by jumping until a forced neighbor,
+    the goal or a possible turn towards it is found, so only the few jump
+    points are pushed onto the heap. Returns the same tile path as a_star.
+    """
+    start = graph.cell_of[start_id]
+    goal = graph.cell_of[goal_id]
+    width = graph.width
+    walkable = graph.walkable
+    adjacency = graph.adjacency
+
+    def is_open(cell):
+        return cell != -1 and (walkable[cell] or cell == goal)
+
+    def jump(cell, slot):
+        """Follow the direction of an adjacency slot from cell and return the next jump point or None"""
+        sides = (2, 3) if slot < 2 else (0, 1)
+        while True:
+            previous, cell = cell, adjacency[4 * cell + slot]
+            if cell == -1:
+                return None
+            if cell == goal:
+                return cell
+            if not walkable[cell]:
+                return None
+            # a side cell that is open here but was not open beside the previous cell is forced
+            for side in sides:
+                if is_open(adjacency[4 * cell + side]) and not is_open(adjacency[4 * previous + side]):
+                    return cell
+            # moving vertically, stop where a horizontal jump finds something so we may turn
+            if slot >= 2 and (jump(cell, 0) is not None or jump(cell, 1) is not None):
+                return cell
+
+    def successors(cell, parent):
+        if parent is None:
+            if not walkable[cell]:
+                # a fixture is left through the adjacent aisle tiles
+                yield from graph.exits(cell)
+                return
+            for slot in range(4):
+                yield jump(cell, slot)
+            return
+        y, x = divmod(cell, width)
+        py, px = divmod(parent, width)
+        if x != px:
+            slots = (2, 3, 0 if x < px else 1)
+        else:
+            slots = (0, 1, 2 if y < py else 3)
+        for slot in slots:
+            yield jump(cell, slot)
+
+    open_set = []
+    heapq.heappush(open_set, (heuristic(graph, start, goal), start))
+    came_from = {start: None}
+    g_score = {start: 0}
+    closed = set()
+    pushes = 0
+
+    while open_set:
+        current = heapq.heappop(open_set)[1]
+        if current in closed:
+            continue
+        closed.add(current)
 
-            if tentative_g_score < g_score[neighbor_id]:
-                came_from[neighbor_id] = current_id
-                g_score[neighbor_id] = tentative_g_score
-                f_score[neighbor_id] = tentative_g_score + heuristic(neighbor, goal_tile)
-                heapq.heappush(open_set, (f_score[neighbor_id], neighbor_id))
+        if current == goal:
+            metrics.count('jps_jump_points_expanded', len(closed))
+            metrics.count('jps_heap_pushes', pushes)
+            # Reconstruct the path, filling in the straight runs between jump points
+            path = [goal_id]
+            while came_from[current] is not None:
+                previous = came_from[current]
+                cy, cx = divmod(current, width)
+                py, px = divmod(previous, width)
+                dx, dy = (px > cx) - (px < cx), (py > cy) - (py < cy)
+                while current != previous:
+                    cx, cy = cx + dx, cy + dy
+                    current = cy * width + cx
+                    path.append(graph.ids[current])
+            return path[::-1]
 
+        for jump_point in successors(current, came_from[current]):
+            if jump_point is None or jump_point in closed:
+                continue
+            tentative_g_score = g_score[current] + heuristic(graph, current, jump_point)
+            if tentative_g_score < g_score.get(jump_point, float('inf')):
+                came_from[jump_point] = current
+                g_score[jump_point] = tentative_g_score
+                heapq.heappush(open_set, (tentative_g_score + heuristic(graph, jump_point, goal), jump_point))
+                pushes += 1
+
+    metrics.count('jps_jump_points_expanded', len(closed))
+    metrics.count('jps_heap_pushes', pushes)
     return []  # Return empty if no path is found
 
 
-def calculate_distances(ids, tile_dict):
-    """Calculate pairwise distances between all tiles in the list using A*"""
-    distances = {}
-    for i in range(len(ids)):
-        for j in range(i + 1, len(ids)):
-            id1, id2 = ids[i], ids[j]
-            path = a_star(id1, id2, tile_dict)
-            distance = len(path) - 1  # distance is the number of edges
-            distances[(id1, id2)] = (distance, path)
-            distances[(id2, id1)] = (distance, path[::-1])
-    return distances
+def bfs(source, graph):
+    """Breadth-first search from a cell over the uniform-cost grid.
+
+    Returns the distance to every cell (-1 if unreachable) and the BFS
+    predecessor tree, from which the path to any cell can be reconstructed.
+    Fixtures are reached but never expanded, except for the source itself.
+    """
+    cells = graph.width * graph.height
+    dist = array('i', [-1]) * cells
+    pred = array('i', [-1]) * cells
+    adjacency = graph.adjacency
+
+    dist[source] = 0
+    frontier = []
+    for neighbor in graph.exits(source):
+        dist[neighbor] = 1
+        pred[neighbor] = source
+        frontier.append(neighbor)
+    depth = 1
+    visited = 1
+    while frontier:
+        depth += 1
+        visited += len(frontier)
+        next_frontier = []
+        for cell in frontier:
+            for neighbor in adjacency[4 * cell:4 * cell + 4]:
+                if neighbor != -1 and dist[neighbor] == -1:
+                    dist[neighbor] = depth
+                    pred[neighbor] = cell
+                    next_frontier.append(neighbor)
+        frontier = next_frontier
+    metrics.count('bfs_trees')
+    metrics.count('bfs_cells_visited', visited)
+    return dist, pred
+
+
+class DistanceMatrix:
+    """Dense all-pairs distance matrix between the tiles to visit.
 
+    Edge costs are uniform, so one BFS per source yields exact distances to all
+    other tiles. Only the predecessor trees are kept and paths are
+    reconstructed on demand instead of storing every path twice.
+    """
 
-def tsp_nearest_neighbor(start_id, end_id, ids, distances: dict):
+    approximate = False  # distances may be longer than the paths returned by path()
+
+    def __init__(self, ids, graph):
+        self.ids = list(ids)
+        self.graph = graph
+        self.index = {tile_id: i for i, tile_id in enumerate(self.ids)}
+        self.predecessors = {}
+
+        cells = [graph.cell_of[tile_id] for tile_id in self.ids]
+        self.matrix = np.full((len(cells), len(cells)), UNREACHABLE, dtype=np.int32)
+        for row, source in enumerate(cells):
+            dist, pred = bfs(source, graph)
+            self.predecessors[source] = pred
+            self.matrix[row] = [dist[cell] if dist[cell] >= 0 else UNREACHABLE for cell in cells]
+
+    @classmethod
+    def from_matrix(cls, ids, matrix, graph=None):
+        """Wrap an existing matrix (e.g. one in shared memory or from the distance cache).
+
+        Without BFS trees, paths are searched per leg on the graph, there are none without a graph.
+        """
+        distances = cls.__new__(cls)
+        distances.ids = list(ids)
+        distances.graph = graph
+        distances.index = {tile_id: i for i, tile_id in enumerate(distances.ids)}
+        distances.predecessors = {}
+        distances.matrix = matrix
+        return distances
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, pair):
+        """Distance between two tile ids"""
+        id1, id2 = pair
+        return int(self.matrix[self.index[id1], self.index[id2]])
+
+    def path(self, id1, id2):
+        """Reconstruct the tile path from id1 to id2 (empty if unreachable)"""
+        if self[id1, id2] >= UNREACHABLE:
+            return []
+        graph = self.graph
+        pred = self.predecessors.get(graph.cell_of[id1])
+        if pred is None:
+            return jump_point_search(id1, id2, graph)
+        cell = graph.cell_of[id2]
+        path = [id2]
+        while pred[cell] != -1:
+            cell = pred[cell]
+            path.append(graph.ids[cell])
+        return path[::-1]
+
+
+def calculate_distances(ids, graph):
+    """Calculate the distance matrix between all tiles in the list using one BFS per tile"""
+    return DistanceMatrix(ids, graph)
+
+
+def tsp_nearest_neighbor(start_id, end_id, ids, distances):
     """Approximate TSP using a greedy nearest-neighbor approach"""
     path = [start_id]
     current_id = start_id
@@ -81,7 +409,7 @@ def tsp_nearest_neighbor(start_id, end_id, ids, distances: dict):
 
     while unvisited:
         # Find the nearest unvisited neighbor
-        next_id = min(unvisited, key=lambda id: distances[(current_id, id)][0])
+        next_id = min(unvisited, key=lambda id: distances[current_id, id])
         path.append(next_id)
         unvisited.remove(next_id)
         current_id = next_id
@@ -94,7 +422,7 @@ def total_distance(path, distances):
     """Calculate the total distance for a given path based on precomputed distances."""
     distance = 0
     for i in range(len(path) - 1):
-        distance += distances[(path[i], path[i+1])][0]
+        distance += distances[path[i], path[i+1]]
     return distance
 
 
@@ -103,92 +431,773 @@ def tsp_brute_force(start_id, end_id, ids, distances):
     # All IDs to visit except the start and end points
     intermediate_ids = set(ids) - {start_id, end_id}
 
+    # Work on matrix rows by index, which is much cheaper than id lookups per edge
+    rows = distances.matrix.tolist()
+    start, end = distances.index[start_id], distances.index[end_id]
+    intermediate = [distances.index[i] for i in intermediate_ids]
+
     # Track the best path and minimum distance
     min_path = None
     min_distance = float('inf')
 
     # Generate all permutations of the intermediate IDs
-    for perm in permutations(intermediate_ids):
+    for perm in permutations(intermediate):
         # Create a full path: start -> perm -> end
-        path = [start_id] + list(perm) + [end_id]
-        distance = total_distance(path, distances)
+        path = (start,) + perm + (end,)
+        distance = sum(rows[a][b] for a, b in zip(path, path[1:]))
 
         # Check if this path is the shortest
         if distance < min_distance:
             min_distance = distance
-            min_path = path
+            min_path = [distances.ids[i] for i in path]
 
+    metrics.count('tsp_permutations', factorial(len(intermediate)))
     return min_path, min_distance
 
 
 
-# TODO implement greedy: lowest cost edge used as long as no degr > 2 created and no path from start to end until all nodes included
-def tsp_greedy(start_id, end_id, ids, distances: dict):
-    path = [start_id]  # Start the path with the starting node
-    current_id = start_id
-    unvisited = set(ids) - {start_id, end_id}
-    edges = []  # Track the edges included in the path
-
-    # Track the degree of each node to avoid nodes of degree > 2
-    degrees = {node: 0 for node in ids}
-    degrees[start_id] = 1  # start and end nodes will each have degree 1
-    degrees[end_id] = 1
-
-    # Helper function to check if adding an edge would form a cycle or violate node degree limits
-    def can_add_edge(from_node, to_node):
-        # Check if adding the edge would exceed the degree limit for either node
-        if degrees[from_node] >= 2 or degrees[to_node] >= 2:
-            return False
-        # Check if the edge would create a cycle
-        temp_edges = edges + [(from_node, to_node)]
-        visited = set()
-
-        def dfs(node):
-            if node in visited:
-                return
-            visited.add(node)
-            for a, b in temp_edges:
-                if a == node and b not in visited:
-                    dfs(b)
-                elif b == node and a not in visited:
-                    dfs(a)
-
-        # Start DFS from the start node and see if all nodes in the path are connected
-        dfs(start_id)
-        # If all nodes in path are connected (visited set includes all but end node), no cycle is created
-        return len(visited) < len(temp_edges) + 1
-
-    # Main loop: Greedily add edges to build the path
-    while unvisited:
-        # Find the nearest unvisited neighbor
-        next_id = min(unvisited, key=lambda id: distances[(current_id, id)][0])
-
-        # Check if we can add the edge without violating the rules
-        if can_add_edge(current_id, next_id):
-            # Add the edge
-            path.append(next_id)
-            edges.append((current_id, next_id))
-            degrees[current_id] += 1
-            degrees[next_id] += 1
-
-            # Update current node and remove from unvisited
-            current_id = next_id
-            unvisited.remove(next_id)
+@lru_cache(maxsize=2)
+def _subset_layers(k):
+    """Subsets of k stops grouped by size, and the position of every subset within its group"""
+    masks = np.arange(1 << k, dtype=np.int32)
+    sizes = np.zeros(1 << k, dtype=np.int8)
+    for j in range(k):
+        sizes += ((masks >> j) & 1).astype(np.int8)
+    order = np.argsort(sizes, kind='stable').astype(np.int32)
+    bounds = np.searchsorted(sizes[order], np.arange(k + 2))
+    layers = [order[bounds[size]:bounds[size + 1]] for size in range(k + 1)]
+    rank = np.empty(1 << k, dtype=np.int32)
+    for layer in layers:
+        rank[layer] = np.arange(len(layer), dtype=np.int32)
+    for values in layers + [rank]:
+        values.flags.writeable = False  # shared between requests
+    return layers, rank
+
+
+def tsp_held_karp(start_id, end_id, ids, distances):
+    """Exact TSP with fixed start and end using Held-Karp bitmask dynamic programming.
+
+    costs[s][j, r] is the length of the shortest path from the start through
+    the r-th subset of s intermediate stops, ending at stop j. Each layer of
+    subsets is extended to every stop with k vectorized passes over blocks of
+    HELD_KARP_BLOCK subsets that stay in cache, then the next layer pulls each
+    subset's cost from the subset without its last stop. The path is walked
+    back from the costs, so no parent table is kept. Takes about 0.1s for 18
+    stops, 0.5s for 20 and 1.1s for 21, and k * 2^k * 4 bytes of memory.
+    """
+    intermediate = [distances.index[i] for i in dict.fromkeys(ids) if i not in (start_id, end_id)]
+    start, end = distances.index[start_id], distances.index[end_id]
+    k = len(intermediate)
+    if k == 0:
+        return [start_id, end_id], distances[start_id, end_id]
+
+    matrix = distances.matrix.astype(np.int64)
+    inner = matrix[np.ix_(intermediate, intermediate)]
+    # large enough to never win, small enough that adding a distance stays within int32
+    infinity = 1 << 29
+    steps = np.minimum(inner, infinity).astype(np.int32)[:, :, None]  # steps[i] is the column of distances from i
+    layers, rank = _subset_layers(k)
+
+    # the subsets of one stop are ordered by stop
+    first = np.full((k, k), infinity, dtype=np.int32)
+    first[np.arange(k), np.arange(k)] = np.minimum(matrix[start, intermediate], infinity)
+    costs = [None, first]
+    for size in range(1, k):
+        current = costs[size]
+        # extended[j, r] = cheapest path through the r-th subset, then to stop j
+        extended = np.full_like(current, infinity)
+        step = np.empty((k, min(HELD_KARP_BLOCK, current.shape[1])), dtype=np.int32)
+        for begin in range(0, current.shape[1], HELD_KARP_BLOCK):
+            block = current[:, begin:begin + HELD_KARP_BLOCK]
+            best = extended[:, begin:begin + HELD_KARP_BLOCK]
+            candidate = step[:, :block.shape[1]]
+            for i in range(k):
+                np.add(block[i], steps[i], out=candidate)
+                np.minimum(best, candidate, out=best)
+
+        following = layers[size + 1]
+        pulled = np.empty((k, len(following)), dtype=np.int32)
+        source = np.empty(len(following), dtype=np.int32)
+        for j in range(k):
+            # position of each subset without stop j; subsets that lack j get a wrong one and are reset
+            np.bitwise_xor(following, 1 << j, out=source)
+            np.take(rank, source, out=source)
+            np.take(extended[j], source, out=pulled[j], mode='clip')
+            pulled[j, (following >> j) & 1 == 0] = infinity
+        np.minimum(pulled, infinity, out=pulled)
+        costs.append(pulled)
+    metrics.count('tsp_dp_states', (1 << k) * k * k)
+
+    # Close the path to the end point and walk back through the subsets
+    closing = costs[k][:, 0] + matrix[intermediate, end]
+    last = int(closing.argmin())
+    min_distance = int(closing[last])
+
+    order = [intermediate[last]]
+    mask = (1 << k) - 1
+    for size in range(k - 1, 0, -1):
+        mask ^= 1 << last
+        members = np.flatnonzero((mask >> np.arange(k)) & 1)
+        last = int(members[(costs[size][members, rank[mask]] + inner[members, last]).argmin()])
+        order.append(intermediate[last])
+    min_path = [start_id] + [distances.ids[i] for i in reversed(order)] + [end_id]
+    return min_path, min_distance
+
+
+def tsp_greedy(start_id, end_id, ids, distances):
+    """Approximate TSP using greedy edge matching.
+
+    Edges are taken cheapest first as long as no node gets degree > 2 and no
+    cycle is closed. A virtual start-end edge turns the fixed endpoint path into
+    a tour, so the result is always a Hamiltonian path from start to end.
+    """
+    nodes = [distances.index[i] for i in dict.fromkeys([start_id] + list(ids) + [end_id])]
+    start, end = distances.index[start_id], distances.index[end_id]
+    if len(nodes) <= 2:
+        return [start_id, end_id]
+
+    # union-find over positions in `nodes` with degree counters
+    parent = list(range(len(nodes)))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    position = {node: i for i, node in enumerate(nodes)}
+    s, e = position[start], position[end]
+    degrees = [0] * len(nodes)
+    links = [[] for _ in nodes]
+    degrees[s] = degrees[e] = 1  # virtual start-end edge
+    parent[e] = s
+
+    rows, cols = np.triu_indices(len(nodes), 1)
+    weights = distances.matrix[np.ix_(nodes, nodes)][rows, cols]
+    edges_needed = len(nodes) - 2  # real edges that leave one open fragment
+    for k in np.argsort(weights, kind='stable'):
+        if edges_needed == 0:
+            break
+        u, v = int(rows[k]), int(cols[k])
+        if degrees[u] >= 2 or degrees[v] >= 2:
+            continue
+        root_u, root_v = find(u), find(v)
+        if root_u == root_v:
+            continue
+        parent[root_v] = root_u
+        degrees[u] += 1
+        degrees[v] += 1
+        links[u].append(v)
+        links[v].append(u)
+        edges_needed -= 1
+
+    # Close the tour with the last edge between the two open fragment ends
+    u, v = [i for i in range(len(nodes)) if degrees[i] < 2]
+    links[u].append(v)
+    links[v].append(u)
+
+    # Walk from start to end along the real edges
+    path = [s]
+    previous, current = None, s
+    while current != e:
+        previous, current = current, next(n for n in links[current] if n != previous)
+        path.append(current)
+    return [distances.ids[nodes[i]] for i in path]
+
+
+def improve_path(path, distances, time_limit=0.05, max_iterations=None, neighbor_count=8, cancelled=None):
+    """Improve an open path with fixed start and end using 2-opt and Or-opt moves.
+
+    Every move is evaluated in O(1) from the distance matrix and candidate moves
+    are restricted to the ``neighbor_count`` nearest stops of each stop. Stops
+    at the first local optimum, when the time (seconds) or iteration budget
+    runs out or once the ``cancelled`` event is set, whichever comes first.
+    """
+    rows = distances.matrix.tolist()
+    route = [distances.index[i] for i in path]
+    m = len(route)
+    if m < 4:
+        return list(path)
+
+    nearest = {
+        a: sorted((b for b in route if b != a), key=rows[a].__getitem__)[:neighbor_count]
+        for a in route
+    }
+    deadline = time.perf_counter() + time_limit if time_limit is not None else None
+
+    iteration = 0
+    improved = True
+    while improved:
+        if max_iterations is not None and iteration >= max_iterations:
+            break
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+        if cancelled is not None and cancelled.is_set():
+            break
+        iteration += 1
+        improved = False
+        position = {node: i for i, node in enumerate(route)}
+
+        # 2-opt: connect a stop to one of its nearest stops by reversing the
+        # segment in between, replacing edges (i, i+1) and (j, j+1)
+        for i in range(m - 1):
+            a = route[i]
+            for c in nearest[a]:
+                lo, hi = sorted((i, position[c]))
+                if hi - lo < 2 or hi >= m - 1:
+                    continue
+                lo_next, hi_next = route[lo + 1], route[hi + 1]
+                delta = rows[a][c] + rows[lo_next][hi_next] - rows[route[lo]][lo_next] - rows[route[hi]][hi_next]
+                if delta < 0:
+                    route[lo + 1:hi + 1] = route[lo + 1:hi + 1][::-1]
+                    improved = True
+                    break
+            if improved:
+                break
+        if improved:
+            continue
+
+        # Or-opt: move a segment of 1-3 stops next to one of its nearest stops
+        for length in (1, 2, 3):
+            for i in range(1, m - length):
+                first, last = route[i], route[i + length - 1]
+                before, after = route[i - 1], route[i + length]
+                removed = rows[before][first] + rows[last][after] - rows[before][after]
+                for c in nearest[first]:
+                    for j in (position[c], position[c] - 1):  # insert after j
+                        if j < 0 or j >= m - 1 or i - 1 <= j <= i + length - 1:
+                            continue
+                        left, right = route[j], route[j + 1]
+                        forward = rows[left][first] + rows[last][right]
+                        backward = rows[left][last] + rows[first][right]
+                        delta = min(forward, backward) - rows[left][right] - removed
+                        if delta < 0:
+                            segment = route[i:i + length]
+                            if backward < forward:
+                                segment.reverse()
+                            rest = route[:i] + route[i + length:]
+                            insert_at = j + 1 if j < i else j + 1 - length
+                            route = rest[:insert_at] + segment + rest[insert_at:]
+                            improved = True
+                            break
+                    if improved:
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+
+    metrics.count('tsp_local_search_iterations', iteration)
+    return [distances.ids[i] for i in route]
+
+
+def tsp_local_search(start_id, end_id, ids, distances, initial_path=None, time_limit=0.05, max_iterations=None,
+                     cancelled=None):
+    """Approximate TSP by improving a nearest-neighbor (or given) path with 2-opt and Or-opt"""
+    if initial_path is None:
+        initial_path = tsp_nearest_neighbor(start_id, end_id, ids, distances)
+    path = improve_path(initial_path, distances, time_limit=time_limit, max_iterations=max_iterations,
+                        cancelled=cancelled)
+    return path, total_distance(path, distances)
+
+
+def insert_stops(path, stops, distances):
+    """Insert each stop into the path where it adds the least distance (cheapest insertion)"""
+    rows = distances.matrix
+    route = [distances.index[i] for i in path]
+    for stop in stops:
+        node = distances.index[stop]
+        previous, following = np.array(route[:-1]), np.array(route[1:])
+        added = (rows[previous, node].astype(np.int64) + rows[node, following] - rows[previous, following])
+        route.insert(int(added.argmin()) + 1, node)
+    return [distances.ids[i] for i in route]
+
+
+def remove_stops(path, stops):
+    """Drop stops from the path, keeping start and end"""
+    stops = set(stops) - {path[0], path[-1]}
+    return [tile_id for tile_id in path if tile_id not in stops]
+
+
+# Number of remaining-set spanning tree weights memoized by branch and bound
+BRANCH_AND_BOUND_MEMO_SIZE = 1 << 20
+
+
+def _spanning_tree_weight(nodes, rows):
+    """Weight of a minimum spanning tree over the given matrix indices (Prim's algorithm)"""
+    if len(nodes) < 2:
+        return 0
+    best = {node: rows[nodes[0]][node] for node in nodes[1:]}
+    total = 0
+    while best:
+        node = min(best, key=best.__getitem__)
+        total += best.pop(node)
+        row = rows[node]
+        for other in best:
+            if row[other] < best[other]:
+                best[other] = row[other]
+    return total
+
+
+def branch_and_bound(start_id, end_id, ids, distances, initial_path=None, time_limit=None, cancelled=None,
+                     on_improve=None):
+    """Exact TSP with fixed start and end using depth-first branch and bound.
+
+    The incumbent is seeded from the nearest-neighbor path improved by local
+    search. A partial path ending at stop c is pruned if its cost plus a lower
+    bound on the rest exceeds the incumbent. The bound is the cheapest edge
+    from c into the remaining stops, plus a minimum spanning tree over them,
+    plus the cheapest edge from them to the end. The search uses an explicit
+    stack over fixed-size arrays, one slot per depth, and tries one candidate
+    per iteration, so the clock is checked before every bound.
+
+    Returns ``(path, distance, complete)``, where ``complete`` is False if the
+    time limit (seconds) or the ``cancelled`` event stopped the search before
+    optimality was proven. The time limit includes building the seed path.
+    ``on_improve(path, distance)`` is called with every better path found.
+    """
+    deadline = time.perf_counter() + time_limit if time_limit is not None else None
+    rows = distances.matrix.tolist()
+    start, end = distances.index[start_id], distances.index[end_id]
+    intermediate = [distances.index[i] for i in dict.fromkeys(ids) if i not in (start_id, end_id)]
+    k = len(intermediate)
+
+    if initial_path is None:
+        seed_limit = 0.05 if deadline is None else max(deadline - time.perf_counter(), 0)
+        initial_path = improve_path(tsp_nearest_neighbor(start_id, end_id, ids, distances), distances,
+                                    time_limit=seed_limit, cancelled=cancelled)
+    best_path = [distances.index[i] for i in initial_path]
+    best_distance = total_distance(initial_path, distances)
+    if k < 2:
+        return list(initial_path), best_distance, True
+
+    # candidates from each node, nearest first, as positions into `intermediate`
+    order = {
+        node: sorted(range(k), key=lambda i: rows[node][intermediate[i]])
+        for node in [start] + intermediate
+    }
+    spanning_trees = {}
+
+    def remaining_bound(current, mask):
+        """Lower bound for going from `current` through all stops in `mask` to the end"""
+        if mask == 0:
+            return rows[current][end]
+        remaining = [intermediate[i] for i in range(k) if mask >> i & 1]
+        tree = spanning_trees.get(mask)
+        if tree is None:
+            if len(spanning_trees) >= BRANCH_AND_BOUND_MEMO_SIZE:
+                spanning_trees.clear()
+            tree = spanning_trees[mask] = _spanning_tree_weight(remaining, rows)
+        row = rows[current]
+        return (min(row[node] for node in remaining) + tree
+                + min(rows[node][end] for node in remaining))
+
+    complete = True
+
+    # array-backed search state: node, cost so far and next candidate per depth
+    path = array('i', [start]) * (k + 1)
+    cost = array('q', [0]) * (k + 1)
+    next_choice = array('i', [0]) * (k + 1)
+    mask = (1 << k) - 1  # stops not yet on the path
+    depth = 0
+    steps = 0
+    while depth >= 0:
+        current = path[depth]
+        if depth == k:
+            distance = cost[depth] + rows[current][end]
+            if distance < best_distance:
+                best_distance = distance
+                best_path = list(path) + [end]
+                if on_improve is not None:
+                    on_improve([distances.ids[i] for i in best_path], best_distance)
+            depth -= 1
+            mask |= 1 << order[path[depth]][next_choice[depth] - 1]
+            continue
+        if next_choice[depth] == k:
+            # all candidates tried, backtrack
+            depth -= 1
+            if depth >= 0:
+                mask |= 1 << order[path[depth]][next_choice[depth] - 1]
+            continue
+
+        i = order[current][next_choice[depth]]
+        next_choice[depth] += 1
+        if not mask >> i & 1:
+            continue
+        steps += 1
+        if (deadline is not None and time.perf_counter() > deadline
+                or cancelled is not None and cancelled.is_set()):
+            complete = False
+            break
+        node = intermediate[i]
+        new_cost = cost[depth] + rows[current][node]
+        if new_cost + remaining_bound(node, mask & ~(1 << i)) >= best_distance:
+            continue
+        # descend
+        mask &= ~(1 << i)
+        depth += 1
+        path[depth] = node
+        cost[depth] = new_cost
+        next_choice[depth] = 0
+
+    metrics.count('tsp_search_nodes', steps)
+    return [distances.ids[i] for i in best_path], best_distance, complete
+
+
+def tsp_branch_and_bound(start_id, end_id, ids, distances):
+    """Exact TSP using branch and bound, returning (path, distance)"""
+    path, distance, _ = branch_and_bound(start_id, end_id, ids, distances)
+    return path, distance
+
+
+def _with_distance(construct):
+    """Wrap a path construction heuristic into a solver returning (path, distance)"""
+    def solver(start_id, end_id, ids, distances):
+        path = construct(start_id, end_id, ids, distances)
+        return path, total_distance(path, distances)
+    return solver
+
+
+# Solvers selectable by name, all returning a (path, distance) tuple
+SOLVERS = {
+    'brute_force': tsp_brute_force,
+    'held_karp': tsp_held_karp,
+    'branch_and_bound': tsp_branch_and_bound,
+    'nearest_neighbor': _with_distance(tsp_nearest_neighbor),
+    'greedy': _with_distance(tsp_greedy),
+    'local_search': tsp_local_search,
+}
+
+
+# Default time budget per route in milliseconds
+DEFAULT_BUDGET_MS = 200
+
+# Largest time budget per route a request may ask for in milliseconds
+MAX_BUDGET_MS = 10000
+
+# Rough cost of one Held-Karp transition in milliseconds, used to predict its runtime
+# (measured 1.2e-6 to 1.7e-6, i.e. 0.1s for 18 stops, 0.5s for 20 and 1.1s for 21)
+HELD_KARP_MS_PER_STATE = 1.6e-6
+
+# Subsets per block of the Held-Karp passes, small enough for k rows to stay in cache
+HELD_KARP_BLOCK = 4096
+
+# Rough cost of one brute force permutation in milliseconds (0.1s for 8 stops, 0.9s for 9)
+BRUTE_FORCE_MS_PER_PERMUTATION = 3e-3
+
+# Most intermediate stops the exact solvers are run for, whatever the budget;
+# the Held-Karp table takes 2^k * k * 4 bytes (176MB at 21)
+HELD_KARP_MAX_STOPS = 21
+EXACT_MAX_STOPS = {'brute_force': 9, 'held_karp': HELD_KARP_MAX_STOPS}
+
+# Largest number of intermediate stops for which branch and bound is tried
+BRANCH_AND_BOUND_MAX_STOPS = 25
+
+
+class SolverLimitError(ValueError):
+    """Raised when an explicitly chosen exact solver cannot solve a route within its limits"""
+
+
+def predicted_ms(solver, k):
+    """Predict the runtime of an exact solver for k intermediate stops in milliseconds"""
+    if solver == 'brute_force':
+        return factorial(k) * BRUTE_FORCE_MS_PER_PERMUTATION
+    return (1 << k) * k * k * HELD_KARP_MS_PER_STATE
+
+
+def check_solver_limits(solver, k, budget_ms):
+    """Raise SolverLimitError if an exact solver would take more stops or time than allowed.
+
+    Exact solvers run to completion, so they are rejected up front instead of
+    overrunning the budget. Other solvers always fit.
+    """
+    if solver not in EXACT_MAX_STOPS:
+        return
+    if k > EXACT_MAX_STOPS[solver]:
+        raise SolverLimitError(f"{solver} solves at most {EXACT_MAX_STOPS[solver]} stops, the route has {k}")
+    predicted = predicted_ms(solver, k)
+    if predicted > budget_ms:
+        raise SolverLimitError(
+            f"{solver} would take about {predicted:.3g}ms for {k} stops, more than the budget of {budget_ms}ms"
+        )
+
+
+def spanning_tree_bound(start_id, end_id, ids, distances):
+    """Lower bound on the shortest start-end path: the weight of a minimum spanning tree.
+
+    Every Hamiltonian path is a spanning tree, so no route can be shorter.
+    """
+    nodes = [distances.index[i] for i in dict.fromkeys([start_id] + list(ids) + [end_id])]
+    weights = distances.matrix[np.ix_(nodes, nodes)].astype(np.int64)
+
+    # Prim's algorithm on the dense matrix
+    in_tree = np.zeros(len(nodes), dtype=bool)
+    in_tree[0] = True
+    best = weights[0].copy()
+    total = 0
+    for _ in range(len(nodes) - 1):
+        candidates = np.where(in_tree, np.iinfo(np.int64).max, best)
+        node = int(candidates.argmin())
+        total += int(best[node])
+        in_tree[node] = True
+        best = np.minimum(best, weights[node])
+    return total
+
+
+def solve_route(start_id, end_id, ids, distances, budget_ms=DEFAULT_BUDGET_MS, solver='auto', cancelled=None,
+                on_improve=None, initial_path=None):
+    """Solve a route within a time budget, choosing the solver by the number of stops.
+
+    With ``solver='auto'``, Held-Karp is used whenever its predicted runtime fits
+    the budget. Up to BRANCH_AND_BOUND_MAX_STOPS stops, branch and bound runs for
+    the rest of the budget. Otherwise the better of the nearest-neighbor and
+    greedy paths is improved by local search until the budget runs out. Returns
+    a dict with the route, the solver that ran, the elapsed time and a lower
+    bound with the resulting optimality gap.
+
+    Setting the ``cancelled`` event stops the search early with the best route
+    so far. ``on_improve(path, distance)`` is called whenever the search finds
+    a better route. An ``initial_path`` over the same stops, e.g. a repaired
+    earlier route, competes with the constructed seeds.
+    """
+    began = time.perf_counter()
+    k = len(set(ids) - {start_id, end_id})
+
+    if solver == 'auto':
+        if k <= HELD_KARP_MAX_STOPS and predicted_ms('held_karp', k) < budget_ms:
+            solver = 'held_karp'
+        elif k <= BRANCH_AND_BOUND_MAX_STOPS:
+            solver = 'branch_and_bound'
         else:
-            # If the edge can't be added, remove the next_id from unvisited and try another node
-            unvisited.remove(next_id)
-
-    # Only connect to the endpoint if all nodes have been visited
-    if can_add_edge(current_id, end_id) and not unvisited:
-        path.append(end_id)
-        edges.append((current_id, end_id))
-        degrees[current_id] += 1
-        degrees[end_id] += 1
+            solver = 'local_search'
+
+    exact = solver in ('brute_force', 'held_karp')
+    if solver in ('local_search', 'branch_and_bound'):
+        seeds = [tsp_nearest_neighbor(start_id, end_id, ids, distances), tsp_greedy(start_id, end_id, ids, distances)]
+        if initial_path is not None:
+            seeds.append(initial_path)
+        seed = min(seeds, key=lambda path: total_distance(path, distances))
+        seed_distance = total_distance(seed, distances)
+        if on_improve is not None:
+            on_improve(seed, seed_distance)
+        remaining = budget_ms / 1000 - (time.perf_counter() - began)
+        path, distance = tsp_local_search(start_id, end_id, ids, distances, initial_path=seed,
+                                          time_limit=max(remaining, 0), cancelled=cancelled)
+        if on_improve is not None and distance < seed_distance:
+            on_improve(path, distance)
+        if solver == 'branch_and_bound':
+            remaining = budget_ms / 1000 - (time.perf_counter() - began)
+            path, distance, exact = branch_and_bound(start_id, end_id, ids, distances, initial_path=path,
+                                                     time_limit=max(remaining, 0), cancelled=cancelled,
+                                                     on_improve=on_improve)
     else:
-        print("Warning: Could not connect to the end node without including all nodes or forming a cycle.")
+        path, distance = SOLVERS[solver](start_id, end_id, ids, distances)
 
-    return path
+    if exact:
+        lower_bound = distance
+    else:
+        lower_bound = spanning_tree_bound(start_id, end_id, ids, distances)
+
+    return {
+        'path': path,
+        'distance': distance,
+        'solver': solver,
+        'elapsed_ms': (time.perf_counter() - began) * 1000,
+        'lower_bound': lower_bound,
+        'gap': (distance - lower_bound) / lower_bound if lower_bound else 0.0,
+    }
+
+
+# Time budget for repairing a route after a small edit in milliseconds
+REPAIR_BUDGET_MS = 20
+
+
+def reoptimize_route(previous_path, distances, added=(), removed=(), budget_ms=REPAIR_BUDGET_MS):
+    """Update a solved route for added and removed stops instead of solving it again.
+
+    Removed stops are cut out and added ones placed by cheapest insertion, then
+    local search repairs the route for at most ``budget_ms``. Start and end stay
+    those of the previous route. Returns a dict like solve_route.
+    """
+    began = time.perf_counter()
+    path = remove_stops(previous_path, removed)
+    path = insert_stops(path, [stop for stop in dict.fromkeys(added) if stop not in path], distances)
+    path = improve_path(path, distances, time_limit=budget_ms / 1000)
+    distance = total_distance(path, distances)
+    lower_bound = spanning_tree_bound(path[0], path[-1], path, distances)
+    return {
+        'path': path,
+        'distance': distance,
+        'solver': 'incremental',
+        'elapsed_ms': (time.perf_counter() - began) * 1000,
+        'lower_bound': lower_bound,
+        'gap': (distance - lower_bound) / lower_bound if lower_bound else 0.0,
+    }
+
+
+class RouteCache:
+    """Memoized solve_route results for repeated and overlapping shopping lists.
+
+    A route only depends on the layout, the set of stops and its start and end,
+    so results are keyed by ``(layout key, frozenset of stops, start, end)``.
+    Holds at most ``max_size`` routes for ``ttl`` seconds, evicting the least
+    recently used first. On a miss, a cached route of the same layout, start
+    and end that differs by at most ``max_delta`` stops is repaired with
+    cheapest insertion and removal and seeds the solver (a warm start).
+    """
+
+    def __init__(self, max_size=1024, ttl=3600, max_delta=4):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_delta = max_delta
+        self.routes = OrderedDict()  # key -> (stored at, route)
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.warm_starts = 0
 
+    def _lookup(self, key, solver):
+        """Return the cached route for a key if it is fresh and good enough for the solver"""
+        entry = self.routes.get(key)
+        if entry is None:
+            return None
+        stored_at, route = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self.routes[key]
+            return None
+        if solver not in ('auto', route['solver']) and route['gap'] > 0:
+            return None  # a heuristic result does not answer a request for another solver
+        self.routes.move_to_end(key)
+        return route
+
+    def _nearest(self, layout_key, stops, start_id, end_id):
+        """Find the cached route whose stops differ least from `stops`, within max_delta"""
+        best, best_delta = None, self.max_delta + 1
+        now = time.monotonic()
+        for (other_layout, other_stops, other_start, other_end), (stored_at, route) in self.routes.items():
+            if (other_layout, other_start, other_end) != (layout_key, start_id, end_id) or now - stored_at > self.ttl:
+                continue
+            delta = len(stops ^ other_stops)
+            if delta < best_delta:
+                best, best_delta = (other_stops, route), delta
+        return best
+
+    def solve(self, layout_key, start_id, end_id, ids, distances, budget_ms=DEFAULT_BUDGET_MS, solver='auto',
+              **options):
+        """solve_route through the cache, the result tells in ``cache`` if it was a hit, warm start or miss"""
+        stops = frozenset(ids) - {start_id, end_id}
+        key = (layout_key, stops, start_id, end_id)
+        with self.lock:
+            route = self._lookup(key, solver)
+            if route is not None:
+                self.hits += 1
+                metrics.count('route_cache_requests', result='hit')
+                return dict(route, path=list(route['path']), cache='hit')
+            self.misses += 1
+            nearest = self._nearest(layout_key, stops, start_id, end_id)
+
+        cache = 'miss'
+        if nearest is not None:
+            other_stops, other = nearest
+            path = remove_stops(other['path'], other_stops - stops)
+            options['initial_path'] = insert_stops(path, stops - other_stops, distances)
+            cache = 'warm'
+        metrics.count('route_cache_requests', result=cache)
+        route = solve_route(start_id, end_id, ids, distances, budget_ms=budget_ms, solver=solver, **options)
+
+        cancelled = options.get('cancelled')
+        if cancelled is not None and cancelled.is_set():
+            return dict(route, cache=cache)  # cut short, not worth keeping
+        with self.lock:
+            if cache == 'warm':
+                self.warm_starts += 1
+            self.routes[key] = (time.monotonic(), route)
+            self.routes.move_to_end(key)
+            while len(self.routes) > self.max_size:
+                self.routes.popitem(last=False)
+        return dict(route, path=list(route['path']), cache=cache)
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.routes), 'hits': self.hits, 'misses': self.misses,
+                    'warm_starts': self.warm_starts}
+
+
+# shared memory matrix attached in a worker process: (name, shared memory, distances)
+_worker_matrix = None
+
+
+def _attach_shared_matrix(name, shape):
+    """Attach the distance matrix of a batch in a worker, reusing it for later tasks"""
+    global _worker_matrix
+    if _worker_matrix is None or _worker_matrix[0] != name:
+        if _worker_matrix is not None:
+            previous = _worker_matrix[1]
+            _worker_matrix = None  # drop the matrix view before closing its buffer
+            previous.close()
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:  # before Python 3.13, workers share the parent's resource tracker
+            shm = shared_memory.SharedMemory(name=name)
+        matrix = np.ndarray(shape, dtype=np.int32, buffer=shm.buf)
+        _worker_matrix = (name, shm, DistanceMatrix.from_matrix(range(shape[0]), matrix))
+    return _worker_matrix[2]
+
+
+def _solve_shared(task):
+    """Solve one route of a batch on the shared matrix, with matrix indices as ids.
+
+    The counters recorded by the solver are returned with the route, the worker's own are never exported.
+    """
+    name, shape, start, end, stops, budget_ms, solver = task
+    distances = _attach_shared_matrix(name, shape)
+    with metrics.collecting() as counters:
+        route = solve_route(start, end, stops, distances, budget_ms=budget_ms, solver=solver)
+    return route, counters
+
+
+def solver_pool(max_workers=None):
+    """Process pool for solve_routes.
+
+    Workers are started from a fork server that only imported this module,
+    not forked from the threaded web server with its locks and connections.
+    Tasks carry everything they need, so no initializer is used.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+    else:
+        context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(max_workers, mp_context=context)
+
+
+def solve_routes(routes, distances, budget_ms=DEFAULT_BUDGET_MS, solver='auto', executor=None):
+    """Solve many routes on the same layout in a process pool.
+
+    ``routes`` is a list of ``(start_id, end_id, ids)`` tuples whose tiles are
+    all part of ``distances``. The matrix is placed in shared memory once, so
+    tasks only carry their own stops. Yields the solve_route results in input
+    order as they become available.
+    """
+    shape = distances.matrix.shape
+    shm = shared_memory.SharedMemory(create=True, size=max(distances.matrix.nbytes, 1))
+    own_executor = executor is None
+    if own_executor:
+        executor = solver_pool()
+    try:
+        np.ndarray(shape, dtype=np.int32, buffer=shm.buf)[:] = distances.matrix
+        index = distances.index
+        tasks = [
+            (shm.name, shape, index[start_id], index[end_id], [index[i] for i in ids], budget_ms, solver)
+            for start_id, end_id, ids in routes
+        ]
+        for route, counters in executor.map(_solve_shared, tasks):
+            metrics.add(counters)
+            route['path'] = [distances.ids[i] for i in route['path']]
+            yield route
+    finally:
+        if own_executor:
+            executor.shutdown()
+        shm.close()
+        shm.unlink()
 
 
 if __name__ == '__main__':
@@ -199,16 +1208,16 @@ if __name__ == '__main__':
         {"id": x+y*width, "x": x, "y": y, "type": None if y > 0 and x > 0 else "wall-corner" if x == 0 and y == 0 else "wall", "rotation": 90 if x == 0 else None} for x in range(0, width) for y in range(0, height)
     ]
 
-    # Convert tiles list to a dictionary for easy access by id
-    tile_dict = {tile['id']: tile for tile in tiles}
+    # Build the grid graph once for fast neighbor lookup
+    graph = StoreGraph(tiles)
 
     # list to collect
-    ids_to_visit = [12, 17, 38, 52, 99, 80]  # List of IDs we want to visit
+    ids_to_visit = [12, 17, 38, 52, 99, 81]  # List of IDs we want to visit
     start_id, end_id = ids_to_visit[0], ids_to_visit[-1]   # Define start and end IDs for TSP
 
     # Step 1: Calculate pairwise distances between IDs
-    distances = calculate_distances(ids_to_visit, tile_dict)
-    print(distances)
+    distances = calculate_distances(ids_to_visit, graph)
+    print(distances.matrix)
 
     # Step 2: Solve TSP to find the shortest path visiting all IDs
     tsp_path = tsp_nearest_neighbor(start_id, end_id, ids_to_visit, distances)
@@ -221,6 +1230,14 @@ if __name__ == '__main__':
     print("Optimal paths:", optimal_path)
     print("Optimal distance:", optimal_distance)
 
-    # greedy_path = tsp_greedy(start_id, end_id, ids_to_visit, distances)
-    # print("Greedy path:", greedy_path)
-    # print("Greedy distance:", total_distance(greedy_path, distances))
+    held_karp_path, held_karp_distance = tsp_held_karp(start_id, end_id, ids_to_visit, distances)
+    print("Held-Karp path:", held_karp_path)
+    print("Held-Karp distance:", held_karp_distance)
+
+    local_search_path, local_search_distance = tsp_local_search(start_id, end_id, ids_to_visit, distances)
+    print("Local search path:", local_search_path)
+    print("Local search distance:", local_search_distance)
+
+    greedy_path = tsp_greedy(start_id, end_id, ids_to_visit, distances)
+    print("Greedy path:", greedy_path)
+    print("Greedy distance:", total_distance(greedy_path, distances))
@@ -0,0 +1,207 @@
+"""Splitting a large pick list across several pickers.
+
+Stops are partitioned with the savings heuristic of Clarke and Wright, adapted
+to open routes from a shared start to a shared end and limited by a load per
+route. The routes are solved in parallel, then stops are moved and swapped
+between routes as long as that shortens the longest one (the makespan).
+"""
+import math
+import time
+
+from pathfinder import (DEFAULT_BUDGET_MS, check_solver_limits, improve_path, solve_routes, spanning_tree_bound,
+                        total_distance)
+
+# time spent re-ordering the two routes changed by an exchange in seconds
+EXCHANGE_REPAIR_LIMIT = 0.005
+
+# share of the budget kept for exchanging stops after the routes are solved
+EXCHANGE_SHARE = 0.2
+
+
+class CapacityError(ValueError):
+    """Raised when the stops cannot be split into the allowed number of routes"""
+
+
+def savings_partition(start_id, end_id, stops, distances, routes, max_load, loads=None):
+    """Merge single stop routes by decreasing savings until at most ``routes`` remain.
+
+    Joining a route ending at i with one starting at j saves
+    ``d(i, end) + d(start, j) - d(i, j)``. Merges that would exceed
+    ``max_load`` are skipped. Returns the stop lists of the routes, which may
+    be more than ``routes`` if the loads do not allow fewer.
+    """
+    loads = loads or {}
+    rows = distances.matrix.tolist()
+    index = distances.index
+    start, end = index[start_id], index[end_id]
+
+    groups = {stop: [stop] for stop in stops}  # first stop -> stops of its route
+    route_of = {stop: stop for stop in stops}  # stop -> first stop of its route
+    load = {stop: loads.get(stop, 1) for stop in stops}  # first stop -> load of its route
+    savings = sorted(
+        ((rows[index[i]][end] + rows[start][index[j]] - rows[index[i]][index[j]], i, j)
+         for i in stops for j in stops if i != j),
+        key=lambda saving: -saving[0],
+    )
+
+    count = len(groups)
+    for _, i, j in savings:
+        if count <= routes:
+            break
+        head_i, head_j = route_of[i], route_of[j]
+        if head_i == head_j or groups[head_i][-1] != i or head_j != j:
+            continue  # i must end one route and j start another
+        if load[head_i] + load[head_j] > max_load:
+            continue
+        groups[head_i] += groups.pop(head_j)
+        load[head_i] += load.pop(head_j)
+        for stop in groups[head_i]:
+            route_of[stop] = head_i
+        count -= 1
+    return list(groups.values())
+
+
+def partition_stops(start_id, end_id, stops, distances, routes, capacity=None, loads=None):
+    """Split stops into at most ``routes`` groups of balanced load.
+
+    The load per route starts at an even share of the total and is relaxed
+    until the savings merges reach the number of routes. Without a
+    ``capacity`` the routes are balanced by their number of stops, which
+    tracks walking distance better than the loads. With one, no route exceeds
+    it and CapacityError is raised if the stops do not fit.
+    """
+    loads = (loads or {}) if capacity is not None else {}
+    total = sum(loads.get(stop, 1) for stop in stops)
+    if capacity is not None and total > capacity * routes:
+        raise CapacityError(f"A load of {total} does not fit in {routes} routes of capacity {capacity}")
+
+    max_load = math.ceil(total / routes) if stops else 0
+    while True:
+        limit = max_load if capacity is None else min(max_load, capacity)
+        groups = savings_partition(start_id, end_id, stops, distances, routes, limit, loads)
+        if len(groups) <= routes:
+            return groups
+        if capacity is not None and limit == capacity:
+            raise CapacityError(f"The stops cannot be packed into {routes} routes of capacity {capacity}")
+        max_load = math.ceil(max_load * 1.25)
+
+
+def _removal_gain(path, i, rows, index):
+    before, stop, after = index[path[i - 1]], index[path[i]], index[path[i + 1]]
+    return rows[before][stop] + rows[stop][after] - rows[before][after]
+
+
+def _best_insertion(path, stop, rows, index):
+    """Return the cheapest position to insert a stop into a path and its added distance"""
+    node = index[stop]
+    return min(
+        (rows[index[path[i]]][node] + rows[node][index[path[i + 1]]] - rows[index[path[i]]][index[path[i + 1]]], i + 1)
+        for i in range(len(path) - 1)
+    )[::-1]
+
+
+def exchange_stops(paths, distances, capacity=None, loads=None, time_limit=0.05):
+    """Move and swap stops between routes while that shortens the longest route.
+
+    A move is accepted if both routes it changes end up shorter than the
+    longest route was, so the sorted route lengths decrease and the search
+    terminates. Changed routes are re-ordered by local search, which counts
+    towards ``time_limit``. Returns the new paths.
+    """
+    loads = loads or {}
+    rows = distances.matrix.tolist()
+    index = distances.index
+    paths = [list(path) for path in paths]
+    lengths = [total_distance(path, distances) for path in paths]
+    load = [sum(loads.get(stop, 1) for stop in path[1:-1]) for path in paths]
+    deadline = time.perf_counter() + time_limit
+
+    def fits(r, added):
+        return capacity is None or load[r] + added <= capacity
+
+    improved = bool(paths)
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        longest = max(range(len(paths)), key=lengths.__getitem__)
+        makespan = lengths[longest]
+        path = paths[longest]
+        for i in range(1, len(path) - 1):
+            if time.perf_counter() >= deadline:
+                break
+            stop = path[i]
+            shortened = makespan - _removal_gain(path, i, rows, index)
+            for other in range(len(paths)):
+                if other == longest:
+                    continue
+                # relocate the stop into the other route
+                position, added = _best_insertion(paths[other], stop, rows, index)
+                if lengths[other] + added < makespan and shortened < makespan and fits(other, loads.get(stop, 1)):
+                    paths[other].insert(position, stop)
+                    del path[i]
+                    load[other] += loads.get(stop, 1)
+                    load[longest] -= loads.get(stop, 1)
+                    improved = True
+                    break
+                # swap it with a stop of the other route in place
+                other_path = paths[other]
+                for j in range(1, len(other_path) - 1):
+                    swap = other_path[j]
+                    a, b = index[path[i - 1]], index[path[i + 1]]
+                    c, d = index[other_path[j - 1]], index[other_path[j + 1]]
+                    s, t = index[stop], index[swap]
+                    new_longest = makespan - rows[a][s] - rows[s][b] + rows[a][t] + rows[t][b]
+                    new_other = lengths[other] - rows[c][t] - rows[t][d] + rows[c][s] + rows[s][d]
+                    difference = loads.get(stop, 1) - loads.get(swap, 1)
+                    if (max(new_longest, new_other) < makespan and fits(other, difference)
+                            and fits(longest, -difference)):
+                        path[i], other_path[j] = swap, stop
+                        load[other] += difference
+                        load[longest] -= difference
+                        improved = True
+                        break
+                if improved:
+                    break
+            if improved:
+                for r in (longest, other):
+                    limit = min(EXCHANGE_REPAIR_LIMIT, max(deadline - time.perf_counter(), 0))
+                    paths[r] = improve_path(paths[r], distances, time_limit=limit)
+                    lengths[r] = total_distance(paths[r], distances)
+                break
+    return paths
+
+
+def plan_routes(start_id, end_id, stops, distances, pickers, capacity=None, loads=None, budget_ms=DEFAULT_BUDGET_MS,
+                solver='auto', executor=None):
+    """Split stops across at most ``pickers`` routes from start to end, minimizing the longest route.
+
+    ``loads`` gives the load of each stop (1 if missing), which no route may
+    carry more than ``capacity`` of. Routes are partitioned by savings, solved
+    in parallel with solve_routes and improved by exchanging stops between
+    them for EXCHANGE_SHARE of the budget and whatever the solvers left.
+    Returns a list of dicts like solve_route, the longest first. Raises
+    SolverLimitError if an exact ``solver`` is too slow for a route.
+    """
+    began = time.perf_counter()
+    stops = list(dict.fromkeys(stop for stop in stops if stop not in (start_id, end_id)))
+    groups = partition_stops(start_id, end_id, stops, distances, pickers, capacity, loads)
+    solve_ms = budget_ms * (1 - EXCHANGE_SHARE)
+    for group in groups:
+        check_solver_limits(solver, len(group), solve_ms)
+
+    routes = list(solve_routes(
+        [(start_id, end_id, [start_id] + group + [end_id]) for group in groups],
+        distances, budget_ms=solve_ms, solver=solver, executor=executor,
+    ))
+    remaining = budget_ms / 1000 - (time.perf_counter() - began)
+    paths = exchange_stops([route['path'] for route in routes], distances, capacity, loads,
+                           time_limit=max(remaining, 0))
+
+    for route, path in zip(routes, paths):
+        if path != route['path']:
+            route['path'] = path
+            route['distance'] = total_distance(path, distances)
+            lower_bound = spanning_tree_bound(start_id, end_id, path, distances)
+            route['lower_bound'] = lower_bound
+            route['gap'] = (route['distance'] - lower_bound) / lower_bound if lower_bound else 0.0
+        route['elapsed_ms'] = (time.perf_counter() - began) * 1000
+    return sorted(routes, key=lambda route: -route['distance'])
@@ -0,0 +1,124 @@
+"""Consolidation of shopping list items into pickup stops.
+
+Items are already grouped by the shelf holding them when they are resolved.
+Shelves are fixtures, so they are picked from a walkable tile next to them,
+and shelves that share such an access tile are merged into one stop. A stop
+can be served from any tile next to all of its shelves, which makes the route
+a generalized TSP: the order is solved over one representative tile per stop,
+then the access tile of every stop is chosen exactly for that order.
+"""
+
+
+class PickupStop:
+    """Shelves picked from one spot, with the tiles that spot may be and the items to pick there"""
+    __slots__ = ('tile', 'options', 'shelves', 'items')
+
+    def __init__(self, tile, options, shelves, items):
+        self.tile = tile  # representative access tile the route is solved with, or the start or end tile
+        self.options = options  # access tiles next to all shelves of the stop, empty at start or end
+        self.shelves = shelves  # shelf tile ids
+        self.items = items
+
+    def __repr__(self):
+        return f"PickupStop({self.tile!r}, {self.options!r}, {self.shelves!r}, {self.items!r})"
+
+
+def access_tiles(graph, tile_id):
+    """Return the tiles a shelf is picked from: the walkable tiles next to it, or itself if it is walkable"""
+    cell = graph.cell_of[tile_id]
+    if graph.walkable[cell]:
+        return [tile_id]
+    return sorted(graph.ids[neighbor] for neighbor in graph.exits(cell))
+
+
+def access_ids(graph, tile_ids):
+    """Return the access tiles of all given shelf tiles, e.g. to precompute their distances"""
+    return sorted({tile for tile_id in tile_ids for tile in access_tiles(graph, tile_id)})
+
+
+def consolidate(graph, shelf_items, shelf_tiles, start_id, end_id):
+    """Merge the shelves of a resolved shopping list into pickup stops.
+
+    ``shelf_items`` maps shelf ids to their items, as returned by
+    resolve_items. Stops are chosen by greedy set cover: the access tile next
+    to the most shelves still to visit becomes a stop for all of them. Shelves
+    without a walkable neighbor keep their own tile, so they stay unreachable
+    as before.
+
+    The route passes start and end anyway, so they are never stops. Shelves
+    only picked from one of them become a stop at that tile without options,
+    which the route does not visit (see route_ids).
+    """
+    endpoints = {start_id, end_id}
+    options = {}  # shelf id -> its access tiles
+    covers = {}  # access tile -> shelf ids picked from it
+    at_endpoint = {}  # start or end tile -> shelf ids only picked from there
+    for shelf_id in shelf_items:
+        if shelf_id not in shelf_tiles:
+            continue
+        tile_id = shelf_tiles[shelf_id]
+        tiles = access_tiles(graph, tile_id) or [tile_id]
+        options[shelf_id] = [tile for tile in tiles if tile not in endpoints]
+        if not options[shelf_id]:
+            at_endpoint.setdefault(start_id if start_id in tiles else end_id, []).append(shelf_id)
+            del options[shelf_id]
+            continue
+        for tile in options[shelf_id]:
+            covers.setdefault(tile, set()).add(shelf_id)
+
+    stops = [
+        PickupStop(tile, [], [shelf_tiles[shelf_id] for shelf_id in shelves],
+                   [item for shelf_id in shelves for item in shelf_items[shelf_id]])
+        for tile, shelves in at_endpoint.items()
+    ]
+    remaining = set(options)
+    while remaining:
+        tile = min(covers, key=lambda tile: (-len(covers[tile] & remaining), tile))
+        shelves = sorted(covers[tile] & remaining)
+        remaining -= covers[tile]
+        common = set.intersection(*(set(options[shelf_id]) for shelf_id in shelves))
+        stops.append(PickupStop(
+            tile,
+            sorted(common),
+            [shelf_tiles[shelf_id] for shelf_id in shelves],
+            [item for shelf_id in shelves for item in shelf_items[shelf_id]],
+        ))
+    return stops
+
+
+def route_ids(start_id, end_id, stops):
+    """Return the tiles a route over the stops is solved with: start, a representative per stop, end"""
+    return [start_id] + [stop.tile for stop in stops if stop.options] + [end_id]
+
+
+def candidate_ids(start_id, end_id, stops):
+    """Return all tiles a route over the stops may use, the ids its distance matrix needs"""
+    return list(dict.fromkeys([start_id] + [tile for stop in stops for tile in stop.options] + [end_id]))
+
+
+def choose_access_tiles(path, stops, distances):
+    """Pick the access tile of every stop along a route solved over the representative tiles.
+
+    For a fixed order this is a shortest path through one layer of candidate
+    tiles per stop, solved exactly by dynamic programming. Start and end stay.
+    Returns the new path and its distance.
+    """
+    options = {stop.tile: stop.options for stop in stops if stop.options}
+    layers = [[path[0]]] + [options.get(tile, [tile]) for tile in path[1:-1]] + [[path[-1]]]
+
+    # best[i][tile] = (distance of the best path ending at tile in layer i, previous tile)
+    best = [{path[0]: (0, None)}]
+    for layer in layers[1:]:
+        previous = best[-1]
+        best.append({
+            tile: min((distance + distances[before, tile], before) for before, (distance, _) in previous.items())
+            for tile in layer
+        })
+
+    tile = path[-1]
+    distance = best[-1][tile][0]
+    route = []
+    for layer in reversed(best):
+        route.append(tile)
+        tile = layer[tile][1]
+    return route[::-1], distance
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# tile types of the characters of a drawn layout
+TILE_TYPES = {'.': None, '#': 'wall', 'S': 'shelf-boxes', 'D': 'wall-door-rotate', 'R': 'cash-register'}
+
+
+def tiles_from_rows(rows):
+    """Build tiles in the /map-data format from rows of characters, numbering shelves in reading order"""
+    tiles = []
+    shelf_id = 0
+    for y, row in enumerate(rows):
+        for x, char in enumerate(row):
+            tile = {"id": x + y * len(row), "x": x, "y": y, "type": TILE_TYPES[char], "shelf_id": None}
+            if char == 'S':
+                shelf_id += 1
+                tile['shelf_id'] = shelf_id
+            tiles.append(tile)
+    return tiles
+
+
+@pytest.fixture
+def layout():
+    return tiles_from_rows
@@ -0,0 +1,25 @@
+import json
+import struct
+
+from assets import ModelAssets
+
+
+def test_bundles_are_bounded_and_parse(tmp_path):
+    for model_type in ['freezer', 'shelf-boxes', 'wall', 'floor']:
+        (tmp_path / f'{model_type}.fbx').write_bytes(model_type.encode() * 10)
+    assets = ModelAssets(str(tmp_path), max_bundles=2)
+
+    digest = assets.bundle(['wall', 'freezer', 'unknown'])
+    assert assets.bundle(['freezer', 'wall']) == digest
+    body = assets.bundles[digest].body
+    length, = struct.unpack_from('<I', body)
+    header = json.loads(body[4:4 + length])
+    payload = body[4 + length:]
+    assert {model_type: payload[offset:offset + size] for model_type, (offset, size) in header.items()} == \
+        {'freezer': b'freezer' * 10, 'wall': b'wall' * 10}
+
+    other = assets.bundle(['floor'])
+    assets.bundle(['freezer', 'wall'])  # most recently used
+    assets.bundle(['shelf-boxes'])
+    assert list(assets.bundles) == [digest, assets.bundle(['shelf-boxes'])]
+    assert other not in assets.bundles
@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+
+from db import GroceryDBInterface, create_schema
+
+
+def old_database(path):
+    """A catalog as created before the search index and catalog version existed"""
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE categories (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+        CREATE TABLE groceries (
+            id INTEGER PRIMARY KEY,
+            shelf_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            category_id INTEGER NOT NULL
+        );
+        INSERT INTO categories (id, name) VALUES (1, 'Milch'), (2, 'Brot');
+        INSERT INTO groceries (shelf_id, name, category_id) VALUES
+            (4, 'Vollmilch', 1), (4, 'Fettarme Milch', 1), (6, 'Roggenbrot', 2);
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def test_ensure_schema_upgrades_old_database(tmp_path):
+    path = str(tmp_path / 'grocery_store.db')
+    old_database(path)
+    db = GroceryDBInterface(path)
+    db.ensure_schema()
+    db.ensure_schema()  # idempotent
+
+    assert {grocery.name for grocery in db.search_groceries('milch')} == {'Fettarme Milch', 'Vollmilch'}
+    assert db.resolve_items(['Brot', 'vollmilch', 'Käse']) == {6: ['Brot'], 4: ['vollmilch']}
+    version = db._query('SELECT version FROM catalog_version', row_factory=None)
+    assert version == [(0,)]
+
+
+def test_ensure_schema_keeps_search_index_in_sync(tmp_path):
+    path = str(tmp_path / 'grocery_store.db')
+    old_database(path)
+    GroceryDBInterface(path).ensure_schema()
+
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO groceries (shelf_id, name, category_id) VALUES (7, 'Toastbrot', 2)")
+    conn.commit()
+    conn.close()
+
+    db = GroceryDBInterface(path)
+    assert [grocery.name for grocery in db.search_groceries('toast')] == ['Toastbrot']
+    assert db._query('SELECT version FROM catalog_version', row_factory=None) == [(1,)]
+
+
+def test_resolve_items_matches_search_for_sharp_s_and_umlauts(tmp_path):
+    path = str(tmp_path / 'grocery_store.db')
+    conn = sqlite3.connect(path)
+    create_schema(conn.cursor())
+    conn.executescript('''
+        INSERT INTO categories (id, name) VALUES (1, 'Süßigkeiten'), (2, 'Soßen'), (3, 'Essig'), (4, 'Öl');
+        INSERT INTO groceries (shelf_id, name, category_id) VALUES
+            (3, 'Bonbons', 1), (5, 'BBQ-Soße', 2), (8, 'Weißweinessig', 3), (9, 'Olivenöl', 4);
+    ''')
+    conn.commit()
+    conn.close()
+
+    db = GroceryDBInterface(path)
+    items = ['Süßigkeiten', 'soßen', 'Weißweinessig ', 'öl']
+    assert db.resolve_items(items) == {3: ['Süßigkeiten'], 5: ['soßen'], 8: ['Weißweinessig '], 9: ['öl']}
+    for item in items:
+        assert [grocery.shelf_id for grocery in db.search_groceries(item.strip())][:1] == \
+            list(db.resolve_items([item]))
+
+
+def test_connections_are_reused_across_threads(tmp_path, monkeypatch):
+    path = str(tmp_path / 'grocery_store.db')
+    old_database(path)
+    db = GroceryDBInterface(path, pool_size=2)
+    db.ensure_schema()
+    opened = []
+    connect = db._connect
+    monkeypatch.setattr(db, '_connect', lambda: opened.append(1) or connect())
+
+    # a new thread per request, like app.run(threaded=True)
+    for _ in range(10):
+        thread = threading.Thread(target=db.search_groceries, args=('milch',))
+        thread.start()
+        thread.join()
+    assert len(opened) == 1
+
+    # concurrent queries open more connections, but only pool_size stay open
+    barrier = threading.Barrier(4)
+
+    def query():
+        barrier.wait()
+        db.get_all_groceries()
+
+    threads = [threading.Thread(target=query) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert db._idle.qsize() <= 2
+    db.close()
+    assert db._idle.qsize() == 0
@@ -0,0 +1,150 @@
+import random
+
+import numpy as np
+import pytest
+
+from benchmarks.generators import SyntheticStore
+from distance_cache import (DistanceCache, changed_edges, earlier_layout, pickup_ids, update_distances)
+from pathfinder import UNREACHABLE, StoreGraph, bfs
+
+EDIT_TYPES = [None, 'shelf-boxes', 'wall', 'freezer']
+
+
+def fresh_distances(graph, sources):
+    """Distances between the source cells from a BFS per source on the current layout"""
+    rows = [np.asarray(bfs(source, graph)[0])[sources] for source in sources]
+    return np.where(np.array(rows) < 0, UNREACHABLE, rows)
+
+
+def assert_exact(graph, cache):
+    index, matrix = cache.layouts[graph.layout_key()]
+    assert (matrix == fresh_distances(graph, list(index))).all()
+
+
+def random_edits(store, rng, count):
+    floor = [tile['id'] for tile in store.tiles if tile['type'] is None or tile['shelf_id'] is not None]
+    return {tile_id: rng.choice(EDIT_TYPES) for tile_id in rng.sample(floor, count)}
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_apply_edits_matches_fresh_bfs(tmp_path, seed):
+    store = SyntheticStore(24, 20, seed=seed)
+    graph = StoreGraph(store.tiles)
+    cache = DistanceCache(str(tmp_path / 'distances.db'))
+    cache.load_layout(graph, pickup_ids(store.tiles))
+    rng = random.Random(seed)
+
+    for _ in range(8):
+        cache.apply_edits(graph, random_edits(store, rng, rng.randint(1, 3)))
+        assert_exact(graph, cache)
+
+    # a fresh cache reads the same distances back from the database
+    reloaded = DistanceCache(cache.db_path)
+    assert reloaded.load_layout(graph, pickup_ids(store.tiles)) == 0
+    assert_exact(graph, reloaded)
+
+
+def test_new_sources_are_added_after_edits(tmp_path):
+    store = SyntheticStore(24, 20, seed=1)
+    graph = StoreGraph(store.tiles)
+    cache = DistanceCache(str(tmp_path / 'distances.db'))
+    sources = pickup_ids(store.tiles)
+    cache.load_layout(graph, sources[::2])
+    rng = random.Random(1)
+    for _ in range(5):
+        cache.apply_edits(graph, random_edits(store, rng, 2))
+
+    assert cache.load_layout(graph, sources) == len(sources[1::2])
+    assert_exact(graph, cache)
+
+
+def test_edit_away_from_sources_keeps_distances(tmp_path):
+    store = SyntheticStore(40, 40, seed=0)
+    graph = StoreGraph(store.tiles)
+    cache = DistanceCache(str(tmp_path / 'distances.db'))
+    cache.load_layout(graph, pickup_ids(store.tiles))
+    sources = len(cache.layouts[graph.layout_key()][0])
+
+    # block and unblock a tile of the main aisle along the top wall
+    aisle = store.tiles[1 * store.width + store.width // 2]['id']
+    _, recomputed = cache.apply_edits(graph, {aisle: 'wall'})
+    assert len(recomputed) < sources // 10
+    _, recomputed = cache.apply_edits(graph, {aisle: None})
+    assert len(recomputed) < sources // 10
+    assert_exact(graph, cache)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_update_distances_against_fresh_bfs(seed):
+    store = SyntheticStore(20, 16, seed=seed)
+    graph = StoreGraph(store.tiles)
+    rng = random.Random(seed)
+    sources = [graph.cell_of[tile_id] for tile_id in pickup_ids(store.tiles)]
+    matrix = fresh_distances(graph, sources)
+    adjacency = graph.adjacency[:]
+
+    changes = graph.set_tile_types(random_edits(store, rng, rng.randint(1, 4)))
+    assert changes == changed_edges(adjacency, graph.adjacency)
+    updated, recomputed = update_distances(matrix, sources, earlier_layout(graph, adjacency), graph, changes)
+    assert (updated == fresh_distances(graph, sources)).all()
+    assert len(recomputed) <= len(sources)
+
+
+def test_cached_distances_search_leg_paths(tmp_path):
+    store = SyntheticStore(24, 20, seed=3)
+    graph = StoreGraph(store.tiles)
+    cache = DistanceCache(str(tmp_path / 'distances.db'))
+    ids = random.Random(3).sample(pickup_ids(store.tiles), 8)
+    distances = cache.distances(ids, graph)
+
+    for a in ids:
+        for b in ids:
+            leg = distances.path(a, b)
+            if distances[a, b] < UNREACHABLE:
+                assert leg[0] == a and leg[-1] == b and len(leg) - 1 == distances[a, b]
+            else:
+                assert leg == []
+
+
+def stored_layouts(cache):
+    with cache._connect() as conn:
+        return {row[0] for row in conn.execute('SELECT layout_key FROM layouts')}
+
+
+def test_new_layout_reuses_distances_of_named_parent_only(tmp_path):
+    store = SyntheticStore(24, 20, seed=2)
+    cache = DistanceCache(str(tmp_path / 'distances.db'))
+    graph = StoreGraph(store.tiles)
+    parent = graph.layout_key()
+    computed = cache.load_layout(graph, pickup_ids(store.tiles))
+
+    # opening a corner lengthens no distance, but only the named parent is migrated from
+    edited = StoreGraph(store.tiles)
+    edited.set_tile_types({store.tiles[0]['id']: None})
+    assert DistanceCache(cache.db_path).load_layout(edited, pickup_ids(store.tiles)) == computed
+    edited.set_tile_types({store.tiles[store.width - 1]['id']: None})
+    reused = DistanceCache(cache.db_path)
+    assert reused.load_layout(edited, pickup_ids(store.tiles), parent=parent) == 0
+    assert_exact(edited, reused)
+    assert parent in stored_layouts(cache)
+
+
+def test_layouts_expire_least_recently_used_first(tmp_path):
+    store = SyntheticStore(16, 12, seed=0)
+    graph = StoreGraph(store.tiles)
+    cache = DistanceCache(str(tmp_path / 'distances.db'), max_layouts=2)
+    cache.load_layout(graph, pickup_ids(store.tiles))
+    keys = [graph.layout_key()]
+    floor = [tile['id'] for tile in store.tiles if tile['type'] is None][:3]
+    for tile_id in floor:
+        cache.apply_edits(graph, {tile_id: 'wall'})
+        keys.append(graph.layout_key())
+    assert stored_layouts(cache) == set(keys[-3:])
+
+    with cache._connect() as conn:
+        stored = {row[0] for row in conn.execute('SELECT layout_key FROM layout_distances')}
+    assert stored == set(keys[-3:])
+
+    cache = DistanceCache(cache.db_path, max_age=0)
+    cache.load_layout(graph, pickup_ids(store.tiles))
+    assert stored_layouts(cache) == {keys[-1]}
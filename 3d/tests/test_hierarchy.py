@@ -0,0 +1,21 @@
+import pytest
+
+from benchmarks.generators import SyntheticStore
+from distance_cache import pickup_ids
+from hierarchy import HierarchicalGraph
+from pathfinder import DistanceMatrix, StoreGraph
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_refined_legs_are_no_longer_than_estimates(seed):
+    store = SyntheticStore(40, 32, seed=seed)
+    graph = StoreGraph(store.tiles)
+    ids = pickup_ids(store.tiles)[:12]
+    estimates = HierarchicalGraph(graph, cluster_size=8).distances(ids)
+    exact = DistanceMatrix(ids, graph)
+    assert estimates.approximate and not exact.approximate
+
+    for a in ids:
+        for b in ids:
+            leg = estimates.path(a, b)
+            assert len(leg) - 1 == exact[a, b] <= estimates[a, b]
@@ -0,0 +1,53 @@
+import threading
+import time
+
+from locks import ReadWriteLock
+
+
+def test_writer_waits_for_readers():
+    lock = ReadWriteLock()
+    events = []
+
+    def write():
+        with lock.writing():
+            events.append('write')
+
+    def read():
+        with lock.reading():
+            time.sleep(0.05)
+            events.append('read')
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    time.sleep(0.01)
+    writer = threading.Thread(target=write)
+    writer.start()
+    for thread in readers + [writer]:
+        thread.join(1)
+    assert events == ['read', 'read', 'write']
+
+
+def test_waiting_writer_goes_before_new_readers():
+    lock = ReadWriteLock()
+    events = []
+
+    def write():
+        with lock.writing():
+            events.append('write')
+
+    def read():
+        with lock.reading():
+            events.append('read')
+
+    with lock.reading():
+        writer = threading.Thread(target=write)
+        writer.start()
+        time.sleep(0.05)
+        reader = threading.Thread(target=read)
+        reader.start()
+        time.sleep(0.05)
+        assert events == []
+    writer.join(1)
+    reader.join(1)
+    assert events == ['write', 'read']
@@ -0,0 +1,19 @@
+import gzip
+import json
+
+from werkzeug.datastructures import Accept
+
+from map_transport import EncodedMap
+
+
+def test_encodings_are_compressed_on_first_request(layout):
+    encoded = EncodedMap(layout(['#####', '#.S.#', '#...#', '#R.D#', '#####']), columnar=False)
+    assert encoded.variants == {}
+
+    assert encoded.pick(Accept()) == (None, encoded.body, encoded.etag)
+    assert encoded.variants == {}
+
+    encoding, body, etag = encoded.pick(Accept([('gzip', 1)]))
+    assert (encoding, etag) == ('gzip', f'{encoded.etag}-gzip')
+    assert json.loads(gzip.decompress(body)) == json.loads(encoded.body)
+    assert encoded.pick(Accept([('gzip', 1)]))[1] is body
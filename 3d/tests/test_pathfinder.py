@@ -0,0 +1,252 @@
+import base64
+import json
+import random
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from pathfinder import (UNREACHABLE, DistanceMatrix, RouteCache, SolverLimitError, StoreGraph, a_star, bfs,
+                        branch_and_bound, check_solver_limits, jump_point_search, reoptimize_route, solve_route,
+                        solve_routes, total_distance, tsp_brute_force, tsp_greedy, tsp_held_karp)
+
+
+def random_instance(stops, seed):
+    """Distances between random points of a grid store, start first and end last"""
+    rng = random.Random(seed)
+    points = [(rng.randint(0, 30), rng.randint(0, 30)) for _ in range(stops + 2)]
+    matrix = np.array([[abs(ax - bx) + abs(ay - by) for bx, by in points] for ax, ay in points], dtype=np.int32)
+    ids = list(range(100, 100 + stops + 2))
+    return ids, DistanceMatrix.from_matrix(ids, matrix)
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('stops', [0, 1, 2, 5, 7])
+def test_branch_and_bound_matches_brute_force(stops, seed):
+    ids, distances = random_instance(stops, seed)
+    path, distance, complete = branch_and_bound(ids[0], ids[-1], ids, distances)
+    assert complete
+    assert distance == tsp_brute_force(ids[0], ids[-1], ids, distances)[1]
+    assert sorted(path) == sorted(ids) and path[0] == ids[0] and path[-1] == ids[-1]
+    assert total_distance(path, distances) == distance
+
+
+@pytest.mark.parametrize('time_limit', [0, 0.05])
+def test_branch_and_bound_keeps_time_limit(time_limit):
+    ids, distances = random_instance(25, 0)
+    began = time.perf_counter()
+    path, distance, complete = branch_and_bound(ids[0], ids[-1], ids, distances, time_limit=time_limit)
+    assert time.perf_counter() - began < time_limit + 0.02
+    assert not complete
+    assert sorted(path) == sorted(ids) and total_distance(path, distances) == distance
+
+
+def test_branch_and_bound_stops_when_cancelled():
+    ids, distances = random_instance(25, 1)
+    cancelled = threading.Event()
+    threading.Timer(0.03, cancelled.set).start()
+    began = time.perf_counter()
+    _, _, complete = branch_and_bound(ids[0], ids[-1], ids, distances, cancelled=cancelled)
+    assert time.perf_counter() - began < 0.1
+    assert not complete
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('stops', [0, 1, 2, 5, 7])
+def test_held_karp_matches_brute_force(stops, seed):
+    ids, distances = random_instance(stops, seed)
+    path, distance = tsp_held_karp(ids[0], ids[-1], ids, distances)
+    assert distance == tsp_brute_force(ids[0], ids[-1], ids, distances)[1]
+    assert sorted(path) == sorted(ids) and path[0] == ids[0] and path[-1] == ids[-1]
+    assert total_distance(path, distances) == distance
+
+
+def test_held_karp_with_unreachable_stop():
+    ids, distances = random_instance(4, 0)
+    distances.matrix[3, :] = distances.matrix[:, 3] = UNREACHABLE
+    distances.matrix[3, 3] = 0
+    path, distance = tsp_held_karp(ids[0], ids[-1], ids, distances)
+    assert sorted(path) == sorted(ids)
+    assert distance >= UNREACHABLE
+
+
+@pytest.mark.parametrize('seed', range(10))
+@pytest.mark.parametrize('stops', [0, 1, 2, 5, 12, 40])
+def test_greedy_returns_hamiltonian_path_between_endpoints(stops, seed):
+    ids, distances = random_instance(stops, seed)
+    # endpoints anywhere in the list, the path still starts and ends with them
+    shuffled = ids[:]
+    random.Random(seed).shuffle(shuffled)
+    path = tsp_greedy(ids[0], ids[-1], shuffled, distances)
+    assert path[0] == ids[0] and path[-1] == ids[-1]
+    assert sorted(path) == sorted(ids)
+
+
+def random_rows(width, height, seed):
+    """Rows of a random store drawn with floor, walls and shelves"""
+    rng = random.Random(seed)
+    return [''.join(rng.choices('.#S', weights=(6, 2, 2), k=width)) for _ in range(height)]
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_path_searches_match_bfs_on_random_grids(layout, seed):
+    graph = StoreGraph(layout(random_rows(16, 12, seed)))
+    rng = random.Random(seed)
+    open_cells = [cell for cell in graph.cell_of.values() if not graph.blocked[cell]]
+    for start in rng.sample(open_cells, 6):
+        dist = bfs(start, graph)[0]
+        for goal in rng.sample(open_cells, 10):
+            start_id, goal_id = graph.ids[start], graph.ids[goal]
+            for search in (a_star, jump_point_search):
+                path = search(start_id, goal_id, graph)
+                if dist[goal] == -1:
+                    assert path == []
+                    continue
+                assert len(path) - 1 == dist[goal]
+                assert path[0] == start_id and path[-1] == goal_id
+                cells = [graph.cell_of[tile_id] for tile_id in path]
+                assert all(after in graph.exits(before) for before, after in zip(cells, cells[1:]))
+
+
+@pytest.mark.parametrize('solver, k, budget_ms', [
+    ('brute_force', 10, 10000),  # over the stop limit whatever the budget
+    ('brute_force', 8, 50),
+    ('held_karp', 22, 10000),
+    ('held_karp', 20, 400),
+])
+def test_exact_solvers_rejected_above_limits(solver, k, budget_ms):
+    with pytest.raises(SolverLimitError):
+        check_solver_limits(solver, k, budget_ms)
+
+
+@pytest.mark.parametrize('solver, k, budget_ms', [
+    ('brute_force', 7, 200),
+    ('held_karp', 18, 200),
+    ('held_karp', 21, 10000),
+    ('branch_and_bound', 100, 1),
+    ('auto', 100, 1),
+])
+def test_solvers_within_limits_accepted(solver, k, budget_ms):
+    check_solver_limits(solver, k, budget_ms)
+
+
+def test_solve_routes_in_pool_matches_solve_route():
+    ids, distances = random_instance(12, 2)
+    routes = [(ids[0], ids[-1], [ids[0]] + ids[i:i + 5] + [ids[-1]]) for i in range(1, 10, 2)]
+    solved = list(solve_routes(routes, distances, solver='held_karp'))
+    assert [route['path'] for route in solved] == \
+        [solve_route(start, end, stops, distances, solver='held_karp')['path'] for start, end, stops in routes]
+
+
+def test_route_cache_hit_returns_stored_route():
+    ids, distances = random_instance(10, 3)
+    cache = RouteCache()
+    first = cache.solve('layout', ids[0], ids[-1], ids, distances)
+    assert first['cache'] == 'miss'
+
+    # the same stops in another order are the same route
+    shuffled = ids[1:-1]
+    random.Random(3).shuffle(shuffled)
+    second = cache.solve('layout', ids[0], ids[-1], [ids[0]] + shuffled + [ids[-1]], distances)
+    assert second['cache'] == 'hit'
+    assert second['path'] == first['path'] and second['distance'] == first['distance']
+    assert cache.solve('other layout', ids[0], ids[-1], ids, distances)['cache'] == 'miss'
+
+
+def test_route_cache_heuristic_route_does_not_answer_other_solver():
+    ids, distances = random_instance(12, 4)
+    cache = RouteCache()
+    heuristic = cache.solve('layout', ids[0], ids[-1], ids, distances, solver='nearest_neighbor')
+    assert heuristic['gap'] > 0
+
+    exact = cache.solve('layout', ids[0], ids[-1], ids, distances, solver='held_karp')
+    assert exact['cache'] != 'hit' and exact['solver'] == 'held_karp'
+    assert exact['distance'] <= heuristic['distance']
+    # an optimal route answers any solver
+    assert cache.solve('layout', ids[0], ids[-1], ids, distances, solver='branch_and_bound')['cache'] == 'hit'
+
+
+def test_reoptimize_route_visits_exactly_the_new_stops():
+    ids, distances = random_instance(14, 5)
+    previous = solve_route(ids[0], ids[-1], ids[:10] + ids[-1:], distances)['path']
+    added, removed = ids[10:13], ids[2:4]
+    route = reoptimize_route(previous, distances, added=added, removed=removed)
+    assert route['solver'] == 'incremental'
+    assert sorted(route['path']) == sorted(set(ids[:10] + ids[-1:] + added) - set(removed))
+    assert route['path'][0] == ids[0] and route['path'][-1] == ids[-1]
+    assert route['distance'] == total_distance(route['path'], distances)
+
+
+STORE_ROWS = [
+    "##########",
+    "#.S..S..S#",
+    "#........#",
+    "#S..S..S.#",
+    "#........#",
+    "#.S..S...#",
+    "#D......R#",
+    "##########",
+]
+ITEMS = [f"Artikel {shelf_id}" for shelf_id in range(1, 9)]
+
+
+@pytest.fixture
+def client(tmp_path, layout, monkeypatch):
+    """Test client of the app serving STORE_ROWS, with item i on shelf i"""
+    import app as server
+    from db import GroceryDBInterface, create_schema
+
+    db_path = str(tmp_path / 'grocery_store.db')
+    conn = sqlite3.connect(db_path)
+    create_schema(conn.cursor())
+    conn.execute("INSERT INTO categories (id, name) VALUES (1, 'Sonstiges')")
+    conn.executemany('INSERT INTO groceries (shelf_id, name, category_id) VALUES (?, ?, 1)',
+                     [(shelf_id, item) for shelf_id, item in enumerate(ITEMS, 1)])
+    conn.commit()
+    conn.close()
+
+    tiles = layout(STORE_ROWS)
+    entrance = next(tile['id'] for tile in tiles if tile['type'] == 'wall-door-rotate')
+    register = next(tile['id'] for tile in tiles if tile['type'] == 'cash-register')
+    monkeypatch.setattr(server, 'db_interface', GroceryDBInterface(db_path))
+    monkeypatch.setattr(server, 'route_cache', RouteCache(), raising=False)
+    server.load_store(tiles, entrance, register, db_path=db_path)
+    yield server.app.test_client()
+    server.db_interface.close()
+
+
+def token_path(token):
+    return json.loads(base64.urlsafe_b64decode(token))['path']
+
+
+def test_route_token_round_trip_repairs_route(client):
+    first = client.post('/pathfind', json={'items': ITEMS[:5]}).json
+    items = ITEMS[:2] + ITEMS[3:5] + ITEMS[6:]
+    repaired = client.post('/pathfind', json={'items': items, 'previous': first['token']}).json
+    assert repaired['solver'] == 'incremental'
+
+    solved = client.post('/pathfind', json={'items': items}).json
+    assert solved['solver'] != 'incremental'
+    path = token_path(repaired['token'])
+    assert sorted(path) == sorted(token_path(solved['token']))
+    assert path[0] == token_path(first['token'])[0] and path[-1] == token_path(first['token'])[-1]
+    tiles = repaired['path']
+    assert len(tiles) - 1 == repaired['distance']
+    assert all(abs(a['x'] - b['x']) + abs(a['y'] - b['y']) == 1 for a, b in zip(tiles, tiles[1:]))
+
+
+def test_malformed_or_outdated_token_solves_route_again(client):
+    first = client.post('/pathfind', json={'items': ITEMS[:4]}).json
+    items = ITEMS[:3] + ITEMS[5:6]
+    response = client.post('/pathfind', json={'items': items, 'previous': 'not a token'})
+    assert response.status_code == 200 and response.json['solver'] != 'incremental'
+
+    # a token of the layout before an edit is not repaired on the new one
+    floor = STORE_ROWS[4].index('.') + 4 * len(STORE_ROWS[4])
+    assert client.post('/layout/tiles', json={'tiles': [{'id': floor, 'type': 'wall'}]}).status_code == 200
+    response = client.post('/pathfind', json={'items': items, 'previous': first['token']})
+    assert response.status_code == 200 and response.json['solver'] != 'incremental'
+    assert sorted(token_path(response.json['token'])[1:-1]) == sorted(
+        token_path(client.post('/pathfind', json={'items': items}).json['token'])[1:-1])
@@ -0,0 +1,53 @@
+import random
+import time
+
+import pytest
+
+import metrics
+from picking import EXCHANGE_REPAIR_LIMIT, exchange_stops, partition_stops, plan_routes
+from pathfinder import solve_routes, total_distance
+from test_pathfinder import random_instance
+
+
+def split_instance(stops, routes, seed):
+    """Random stops with loads, partitioned into routes that fit a capacity"""
+    ids, distances = random_instance(stops, seed)
+    rng = random.Random(seed)
+    loads = {stop: rng.randint(1, 4) for stop in ids[1:-1]}
+    capacity = -(-sum(loads.values()) // routes) + 8
+    groups = partition_stops(ids[0], ids[-1], ids[1:-1], distances, routes, capacity, loads)
+    return ids, distances, loads, capacity, [[ids[0]] + group + [ids[-1]] for group in groups]
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_exchange_keeps_capacity_and_stops(seed):
+    ids, distances, loads, capacity, paths = split_instance(30, 4, seed)
+    exchanged = exchange_stops(paths, distances, capacity, loads, time_limit=1)
+
+    assert sorted(stop for path in exchanged for stop in path[1:-1]) == sorted(ids[1:-1])
+    assert all(path[0] == ids[0] and path[-1] == ids[-1] for path in exchanged)
+    assert all(sum(loads[stop] for stop in path[1:-1]) <= capacity for path in exchanged)
+    assert max(total_distance(path, distances) for path in exchanged) <= \
+        max(total_distance(path, distances) for path in paths)
+
+
+@pytest.mark.parametrize('time_limit', [0, 0.02])
+def test_exchange_keeps_time_limit(time_limit):
+    _, distances, loads, capacity, paths = split_instance(150, 3, 0)
+    began = time.perf_counter()
+    exchange_stops(paths, distances, capacity, loads, time_limit=time_limit)
+    assert time.perf_counter() - began < time_limit + EXCHANGE_REPAIR_LIMIT + 0.01
+
+
+def test_plan_routes_keeps_capacity():
+    ids, distances, loads, capacity, _ = split_instance(30, 4, 3)
+    routes = plan_routes(ids[0], ids[-1], ids[1:-1], distances, 4, capacity, loads, budget_ms=200)
+    assert sorted(stop for route in routes for stop in route['path'][1:-1]) == sorted(ids[1:-1])
+    assert all(sum(loads[stop] for stop in route['path'][1:-1]) <= capacity for route in routes)
+
+
+def test_solver_counters_of_workers_are_kept():
+    ids, distances = random_instance(10, 0)
+    with metrics.profiling() as profile:
+        list(solve_routes([(ids[0], ids[-1], ids)], distances, solver='held_karp'))
+    assert profile['counters'].get('tsp_dp_states')
@@ -0,0 +1,90 @@
+import itertools
+
+from pathfinder import StoreGraph, calculate_distances, total_distance
+from pickups import candidate_ids, choose_access_tiles, consolidate, route_ids
+
+ROWS = [
+    "#######",
+    "#...S.#",
+    "#.SS..#",
+    "#.....#",
+    "#S....#",
+    "#D..R.#",
+    "#######",
+]
+
+
+def store(layout):
+    tiles = layout(ROWS)
+    graph = StoreGraph(tiles)
+    shelf_tiles = {tile['shelf_id']: tile['id'] for tile in tiles if tile['shelf_id'] is not None}
+    entrance = next(tile['id'] for tile in tiles if tile['type'] == 'wall-door-rotate')
+    register = next(tile['id'] for tile in tiles if tile['type'] == 'cash-register')
+    return graph, shelf_tiles, entrance, register
+
+
+def test_consolidate_picks_every_shelf_from_a_neighbor(layout):
+    graph, shelf_tiles, entrance, register = store(layout)
+    stops = consolidate(graph, {2: ['Milch'], 3: ['Brot', 'Käse']}, shelf_tiles, entrance, register)
+
+    assert sorted(item for stop in stops for item in stop.items) == ['Brot', 'Käse', 'Milch']
+    for stop in stops:
+        assert stop.tile in stop.options
+        for shelf in stop.shelves:
+            for option in stop.options:
+                assert abs(option % 7 - shelf % 7) + abs(option // 7 - shelf // 7) == 1
+
+
+def test_consolidate_shared_tile_is_one_stop(layout):
+    graph, shelf_tiles, entrance, register = store(layout)
+    shelves = {shelf_id: [f"item {shelf_id}"] for shelf_id in shelf_tiles}
+    stops = consolidate(graph, shelves, shelf_tiles, entrance, register)
+    assert sum(len(stop.shelves) for stop in stops) == len(shelf_tiles)
+    # shelves 1 and 3 stand diagonally, both next to the tiles between them
+    assert [stop.options for stop in stops if len(stop.shelves) == 2] == [[10, 18]]
+    assert len(stops) == len(shelf_tiles) - 1
+
+
+def test_consolidate_never_stops_at_the_entrance(layout):
+    graph, shelf_tiles, entrance, register = store(layout)
+    # shelf 4 stands above the entrance and is also reachable from its right
+    stops = consolidate(graph, {4: ['Milch']}, shelf_tiles, entrance, register)
+    assert [stop.items for stop in stops] == [['Milch']]
+    assert entrance not in stops[0].options and stops[0].tile != entrance
+    assert route_ids(entrance, register, stops) == [entrance, stops[0].tile, register]
+
+
+def test_consolidate_keeps_items_picked_only_at_the_entrance(layout):
+    rows = [
+        "#####",
+        "#S#.#",
+        "#D..#",
+        "#.R.#",
+        "#####",
+    ]
+    tiles = layout(rows)
+    graph = StoreGraph(tiles)
+    entrance, register = 11, 17
+    stops = consolidate(graph, {1: ['Milch']}, {1: 6}, entrance, register)
+
+    assert [(stop.tile, stop.options, stop.items) for stop in stops] == [(entrance, [], ['Milch'])]
+    assert route_ids(entrance, register, stops) == [entrance, register]
+    assert candidate_ids(entrance, register, stops) == [entrance, register]
+
+
+def test_choose_access_tiles_is_optimal_for_the_order(layout):
+    graph, shelf_tiles, entrance, register = store(layout)
+    shelves = {shelf_id: [f"item {shelf_id}"] for shelf_id in shelf_tiles}
+    stops = consolidate(graph, shelves, shelf_tiles, entrance, register)
+    distances = calculate_distances(candidate_ids(entrance, register, stops), graph)
+    path = route_ids(entrance, register, stops)
+
+    chosen, distance = choose_access_tiles(path, stops, distances)
+
+    assert distance == total_distance(chosen, distances)
+    best = min(
+        total_distance([entrance] + list(tiles) + [register], distances)
+        for tiles in itertools.product(*(stop.options for stop in stops if stop.options))
+    )
+    assert distance == best
+    assert chosen[0] == entrance and chosen[-1] == register